@@ -0,0 +1,186 @@
+# === bench/load_test.py ===
+# Offline load test: starts bench/mock_upstreams.py in a subprocess, points the app at it and drives the
+# wallet endpoints in-process over ASGI, then times history logging cycles. Reports throughput and
+# p50 / p95 / p99 latency per endpoint. Needs no network access and no Postgres.
+#
+#   python bench/load_test.py [--wallets 20] [--requests 200] [--concurrency 10] [--latency-ms 50] ...
+#
+# Mock options (latency, failure injection, portfolio size) are passed through to the mock servers.
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import hashlib
+import argparse
+import math
+import httpx
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Everything below imports valuation, whose URLs and limits are read from the environment at import time,
+# so the stand-ins' addresses are fixed first
+PORTS = [free_port() for _ in range(3)]
+os.environ.update({
+    "RPC_URL": f"http://127.0.0.1:{PORTS[0]}",
+    "EXPLORER_API_URL": f"http://127.0.0.1:{PORTS[1]}/api/v2",
+    "GECKOTERMINAL_API_URL": f"http://127.0.0.1:{PORTS[2]}/api/v2",
+})
+# The stand-ins are not rate limited; raise the client-side limits so they do not dominate the numbers
+os.environ.setdefault("GECKO_RATE_PER_MIN", "60000")
+os.environ.setdefault("DEFAULT_RATE_PER_SEC", "100000")
+os.environ.setdefault("DEFAULT_BURST", "100000")
+os.environ.pop("DATABASE_URL", None)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+import mock_upstreams
+import main as app_main
+import history
+import upstream
+
+ENDPOINTS = {
+    "portfolio": lambda wallets, i: f"/portfolio?wallet={wallets[i % len(wallets)]}",
+    "lp-positions": lambda wallets, i: f"/lp-positions?wallet={wallets[i % len(wallets)]}",
+    "staking": lambda wallets, i: f"/staking?wallet={wallets[i % len(wallets)]}",
+    "presales": lambda wallets, i: f"/presales?wallet={wallets[i % len(wallets)]}",
+    "wallets": lambda wallets, i: "/wallets?wallets=" + ",".join(wallets[(i + k) % len(wallets)] for k in range(min(5, len(wallets)))),
+}
+
+
+def make_wallets(n):
+    return ["0x" + hashlib.blake2b(f"bench-wallet-{i}".encode(), digest_size=20).hexdigest() for i in range(n)]
+
+
+def percentile(sorted_values, q):
+    # Nearest rank
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(q / 100 * len(sorted_values)) - 1)]
+
+
+def summarize(name, latencies, errors, partial, elapsed):
+    values = sorted(latencies)
+    return {
+        "name": name,
+        "requests": len(values),
+        "errors": errors,
+        "partial": partial,
+        "rps": len(values) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": (values[-1] if values else 0.0) * 1000,
+    }
+
+
+def print_report(rows):
+    print(f"{'':<14} {'requests':>9} {'errors':>7} {'partial':>8} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for r in rows:
+        print(f"{r['name']:<14} {r['requests']:>9} {r['errors']:>7} {r['partial']:>8} {r['rps']:>8.1f} "
+              f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['max_ms']:>9.1f}")
+
+
+async def start_mocks(args, ports):
+    command = [
+        sys.executable, os.path.join(BENCH_DIR, "mock_upstreams.py"),
+        "--rpc-port", str(ports[0]), "--explorer-port", str(ports[1]), "--gecko-port", str(ports[2]),
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--failure-rate", str(args.failure_rate), "--rate-limit-rate", str(args.rate_limit_rate),
+        "--tokens-per-wallet", str(args.tokens_per_wallet), "--lps-per-wallet", str(args.lps_per_wallet),
+        "--nft-page-size", str(args.nft_page_size), "--block-time", str(args.block_time), "--seed", str(args.seed),
+    ]
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.DEVNULL)
+    rpc_url = f"http://127.0.0.1:{ports[0]}"
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                res = await client.post(rpc_url, json={"jsonrpc": "2.0", "id": 1, "method": "eth_blockNumber", "params": []})
+                if res.status_code == 200:
+                    return process
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("mock upstreams did not start")
+
+
+async def run_endpoint(client, name, wallets, requests, concurrency):
+    path_for = ENDPOINTS[name]
+    latencies, counters = [], {"errors": 0, "partial": 0}
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+
+    async def worker():
+        while not queue.empty():
+            i = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                res = await client.get(path_for(wallets, i))
+                body = res.json()
+                if res.status_code != 200 or "error" in body:
+                    counters["errors"] += 1
+                elif body.get("partial"):
+                    counters["partial"] += 1
+            except Exception:
+                counters["errors"] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(name, latencies, counters["errors"], counters["partial"], time.perf_counter() - started)
+
+
+async def run_log_cycles(wallets, cycles):
+    # What log_loop does each hour, minus the COPY into Postgres
+    durations, failed = [], 0
+    for _ in range(cycles):
+        started = time.perf_counter()
+        snapshots = await history.snapshot_wallets(wallets)
+        durations.append(time.perf_counter() - started)
+        failed += sum(1 for _, snapshot in snapshots if snapshot is None)
+    row = summarize(f"log_cycle x{len(wallets)}", durations, failed, 0, sum(durations))
+    row["rps"] = len(wallets) * cycles / sum(durations) if durations else 0.0
+    return row
+
+
+async def run(args):
+    process = await start_mocks(args, PORTS)
+    try:
+        await upstream.start()
+        wallets = make_wallets(args.wallets)
+        rows = []
+        transport = httpx.ASGITransport(app=app_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            for name in args.endpoints:
+                rows.append(await run_endpoint(client, name, wallets, args.requests, args.concurrency))
+        if args.cycles:
+            rows.append(await run_log_cycles(wallets, args.cycles))
+        await upstream.close()
+
+        print(f"\n{args.wallets} wallets, concurrency {args.concurrency}, mock latency {args.latency_ms}ms "
+              f"(+/-{args.jitter_ms}), failure rate {args.failure_rate}, 429 rate {args.rate_limit_rate}\n")
+        print_report(rows)
+        print("\n(log_cycle: one row per cycle; req/s is wallets valued per second)")
+    finally:
+        process.terminate()
+        await process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline load test against local upstream stand-ins")
+    parser.add_argument("--wallets", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200, help="per endpoint")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS), choices=list(ENDPOINTS))
+    parser.add_argument("--cycles", type=int, default=3, help="history logging cycles to time (0 to skip)")
+    mock_upstreams.add_arguments(parser)
+    args = parser.parse_args()
+    asyncio.run(run(args))
@@ -0,0 +1,73 @@
+# === bench/lp_bench.py ===
+# Times LP valuation for N random positions: vectorized NumPy pass vs. the exact integer path vs. the old
+# per-position float loop, and reports how far the vectorized amounts are from the exact ones.
+#
+#   python bench/lp_bench.py [positions]
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import lp_math
+
+
+def make_positions(n, seed=1):
+    rng = random.Random(seed)
+    positions = []
+    for _ in range(n):
+        tick_lower = rng.randint(-200_000, 200_000)
+        tick_upper = tick_lower + rng.randint(10, 20_000)
+        tick_current = rng.randint(tick_lower - 5_000, tick_upper + 5_000)
+        positions.append((rng.randint(10 ** 10, 10 ** 24), tick_lower, tick_upper, lp_math.get_sqrt_ratio_at_tick(tick_current)))
+    return positions
+
+
+def float_loop(positions):
+    # What process_lp used to do per position
+    out = []
+    for liquidity, tick_lower, tick_upper, sqrt_price_x96 in positions:
+        sqrt_ratio = sqrt_price_x96 / 2 ** 96
+        sqrt_lower = 1.0001 ** (tick_lower / 2)
+        sqrt_upper = 1.0001 ** (tick_upper / 2)
+        if sqrt_price_x96 <= sqrt_lower * 2 ** 96:
+            out.append((liquidity * (sqrt_upper - sqrt_lower) / (sqrt_upper * sqrt_lower), 0))
+        elif sqrt_price_x96 < sqrt_upper * 2 ** 96:
+            out.append((liquidity * (sqrt_upper - sqrt_ratio) / (sqrt_upper * sqrt_ratio), liquidity * (sqrt_ratio - sqrt_lower)))
+        else:
+            out.append((0, liquidity * (sqrt_upper - sqrt_lower)))
+    return out
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def main(n):
+    positions = make_positions(n)
+    columns = list(zip(*positions))
+    zeros = [0] * n
+
+    vectorized, t_vec = timed(lp_math.position_amounts, *columns, zeros, zeros)
+    exact, t_exact = timed(lambda: [lp_math.position_amounts_exact(*p) for p in positions])
+    _, t_loop = timed(float_loop, positions)
+
+    worst = 0.0
+    for i, (exact0, exact1) in enumerate(exact):
+        for exact_amount, approx in ((exact0, vectorized[0][i]), (exact1, vectorized[1][i])):
+            # Amounts of a few wei are dominated by integer rounding, not float error
+            if exact_amount > 10 ** 6:
+                worst = max(worst, abs(approx - exact_amount) / exact_amount)
+
+    print(f"positions:          {n}")
+    print(f"numpy vectorized:   {t_vec * 1000:9.2f} ms  ({n / t_vec:,.0f} positions/s)")
+    print(f"exact integer:      {t_exact * 1000:9.2f} ms  ({n / t_exact:,.0f} positions/s)")
+    print(f"float loop (old):   {t_loop * 1000:9.2f} ms  ({n / t_loop:,.0f} positions/s)")
+    print(f"max rel. deviation: {worst:.2e} (vectorized vs exact)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
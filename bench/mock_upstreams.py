@@ -0,0 +1,400 @@
+# === bench/mock_upstreams.py ===
+# Local stand-ins for every upstream the tracker calls, so it can be benchmarked without network access:
+# a Blockscout-style explorer, a GeckoTerminal API and a JSON-RPC node that answers the LP manager, pool,
+# ERC-20, staking and presale reads directly and through Multicall3. Every wallet address gets a deterministic
+# portfolio. Each server adds configurable latency and can inject 500s and 429s.
+#
+#   python bench/mock_upstreams.py [--rpc-port 8545] [--latency-ms 50] [--failure-rate 0.01] ...
+#
+# then start the app with RPC_URL, EXPLORER_API_URL and GECKOTERMINAL_API_URL pointing at the printed URLs.
+
+import os
+import sys
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from eth_abi import decode, encode
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import lp_math
+import multicall
+import valuation
+
+PEPU_PRICE_USD = 0.0123
+BASE_BLOCK = 1_000_000
+AGGREGATE3_SELECTOR = "0x82ad56cb"
+
+
+def _seed(*parts):
+    return int.from_bytes(hashlib.blake2b(repr(parts).encode(), digest_size=8).digest(), "big")
+
+
+def _address(*parts):
+    return "0x" + hashlib.blake2b(repr(parts).encode(), digest_size=20).hexdigest()
+
+
+class Faults:
+    """Latency and failure injection for one mock server."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, failure_rate=0.0, rate_limit_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+
+    def delay(self):
+        return max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+
+
+class World:
+    """Deterministic chain state: tokens, pools, and a portfolio derived from each wallet address."""
+
+    def __init__(self, seed=1, tokens=200, pools=50, tokens_per_wallet=20, lps_per_wallet=4, other_nfts=2,
+                 nft_page_size=50, block_time=2.0):
+        rng = random.Random(seed)
+        self.seed = seed
+        self.tokens_per_wallet = min(tokens_per_wallet, tokens)
+        self.lps_per_wallet = lps_per_wallet
+        self.other_nfts = other_nfts
+        self.nft_page_size = nft_page_size
+        self.block_time = block_time
+        self.started = time.time()
+
+        self.tokens = []
+        for i in range(tokens):
+            self.tokens.append({
+                "address": _address(seed, "token", i),
+                "symbol": f"MCK{i}",
+                "name": f"Mock Token {i}",
+                "decimals": 18,
+                "price_usd": rng.uniform(0.0001, 50),
+                # A few tokens fall under the app's low-liquidity cut-off
+                "reserve_usd": rng.uniform(10, 900) if i % 11 == 0 else rng.uniform(5_000, 5_000_000),
+            })
+        self.token_by_address = {t["address"]: t for t in self.tokens}
+
+        self.pools = []
+        for p in range(pools):
+            token0, token1 = sorted((self.tokens[p % tokens]["address"], self.tokens[(p * 7 + 1) % tokens]["address"]))
+            tick = rng.randint(-50_000, 50_000)
+            self.pools.append({
+                "address": _address(seed, "pool", p),
+                "token0": token0,
+                "token1": token1,
+                "fee": (500, 3000, 10000)[p % 3],
+                "tick": tick,
+                "sqrt_price_x96": lp_math.get_sqrt_ratio_at_tick(tick),
+                "fee_growth_global0": rng.randint(10 ** 30, 10 ** 33),
+                "fee_growth_global1": rng.randint(10 ** 30, 10 ** 33),
+            })
+        self.pool_by_address = {pool["address"]: pool for pool in self.pools}
+
+    def block_number(self):
+        return BASE_BLOCK + int((time.time() - self.started) / self.block_time)
+
+    def native_balance(self, wallet):
+        return _seed(self.seed, "native", wallet.lower()) % 10 ** 24
+
+    def wallet_tokens(self, wallet):
+        rng = random.Random(_seed(self.seed, "tokens", wallet.lower()))
+        return [(token, rng.randint(1, 10 ** 4) * 10 ** token["decimals"]) for token in rng.sample(self.tokens, self.tokens_per_wallet)]
+
+    def lp_token_ids(self, wallet):
+        base = _seed(self.seed, "lps", wallet.lower()) % 10 ** 9
+        return [base * 1000 + j for j in range(self.lps_per_wallet)]
+
+    def pool_for_position(self, token_id):
+        return self.pools[token_id % len(self.pools)]
+
+    def position(self, token_id):
+        pool = self.pool_for_position(token_id)
+        rng = random.Random(_seed(self.seed, "position", token_id))
+        tick_lower = pool["tick"] - rng.randint(1, 100) * 60
+        tick_upper = pool["tick"] + rng.randint(-20, 100) * 60
+        if tick_upper <= tick_lower:
+            tick_upper = tick_lower + 60
+        return [
+            0, "0x" + "00" * 20, pool["token0"], pool["token1"], pool["fee"], tick_lower, tick_upper,
+            rng.randint(10 ** 18, 10 ** 21), 0, 0, rng.randint(0, 10 ** 15), rng.randint(0, 10 ** 15),
+        ]
+
+    def nft_items(self, wallet):
+        items = []
+        for token_id in self.lp_token_ids(wallet):
+            pool = self.pool_for_position(token_id)
+            symbol0 = self.token_by_address[pool["token0"]]["symbol"]
+            symbol1 = self.token_by_address[pool["token1"]]["symbol"]
+            items.append({
+                "id": str(token_id),
+                "token": {"address": valuation.LP_MANAGER_ADDRESS, "type": "ERC-721"},
+                "metadata": {
+                    "name": f"Uniswap - {pool['fee'] / 10000:g}% - {symbol0}/{symbol1}",
+                    "description": (
+                        f"This NFT represents a liquidity position in a Uniswap V3 {symbol0}-{symbol1} pool.\n\n"
+                        f"Pool Address: {pool['address']}\n{symbol0} Address: {pool['token0']}\n"
+                        f"{symbol1} Address: {pool['token1']}\nFee Tier: {pool['fee'] / 10000:g}%\nToken ID: {token_id}"
+                    ),
+                },
+            })
+        for j in range(self.other_nfts):
+            items.append({"id": str(j), "token": {"address": _address(self.seed, "nft", j), "type": "ERC-721"}, "metadata": {}})
+        return items
+
+
+def _with_faults(app, faults):
+    @app.middleware("http")
+    async def inject(request: Request, call_next):
+        await asyncio.sleep(faults.delay())
+        roll = random.random()
+        if roll < faults.rate_limit_rate:
+            return JSONResponse({"error": "rate limited"}, status_code=429, headers={"Retry-After": "1"})
+        if roll < faults.rate_limit_rate + faults.failure_rate:
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        return await call_next(request)
+
+    return app
+
+
+def explorer_app(world, faults):
+    app = FastAPI()
+
+    @app.get("/api/v2/addresses/{wallet}")
+    async def address(wallet: str):
+        return {"hash": wallet, "coin_balance": str(world.native_balance(wallet))}
+
+    @app.get("/api/v2/addresses/{wallet}/token-balances")
+    async def token_balances(wallet: str):
+        return [
+            {
+                "token": {"address": token["address"], "symbol": token["symbol"], "name": token["name"], "decimals": str(token["decimals"]), "type": "ERC-20"},
+                "value": str(value),
+            }
+            for token, value in world.wallet_tokens(wallet)
+        ]
+
+    @app.get("/api/v2/addresses/{wallet}/nft")
+    async def nfts(wallet: str, page: int = 0):
+        items = world.nft_items(wallet)
+        start = page * world.nft_page_size
+        more = start + world.nft_page_size < len(items)
+        return {"items": items[start:start + world.nft_page_size], "next_page_params": {"page": page + 1} if more else None}
+
+    return _with_faults(app, faults)
+
+
+def geckoterminal_app(world, faults):
+    app = FastAPI()
+
+    def addresses(joined):
+        return [a.lower() for a in joined.split(",") if a]
+
+    @app.get("/api/v2/networks/eth/tokens/{address}")
+    async def eth_token(address: str):
+        return {"data": {"attributes": {"address": address, "price_usd": str(PEPU_PRICE_USD), "image_url": "https://placehold.co/64x64"}}}
+
+    @app.get("/api/v2/simple/networks/pepe-unchained/token_price/{joined}")
+    async def token_price(joined: str):
+        known = [world.token_by_address[a] for a in addresses(joined) if a in world.token_by_address]
+        return {"data": {"attributes": {
+            "token_prices": {t["address"]: str(t["price_usd"]) for t in known},
+            "total_reserve_in_usd": {t["address"]: str(t["reserve_usd"]) for t in known},
+            "h24_volume_usd": {t["address"]: str(t["reserve_usd"] / 10) for t in known},
+            "h24_price_change_percentage": {t["address"]: "1.5" for t in known},
+        }}}
+
+    @app.get("/api/v2/networks/pepe-unchained/tokens/multi/{joined}")
+    async def tokens_multi(joined: str):
+        return {"data": [
+            {"attributes": {"address": t["address"], "symbol": t["symbol"], "decimals": t["decimals"], "image_url": f"https://placehold.co/32x32?text={t['symbol']}"}}
+            for t in (world.token_by_address.get(a) for a in addresses(joined)) if t is not None
+        ]}
+
+    return _with_faults(app, faults)
+
+
+def _abi_type(param):
+    if param["type"].startswith("tuple"):
+        return "(" + ",".join(_abi_type(c) for c in param["components"]) + ")" + param["type"][5:]
+    return param["type"]
+
+
+def _functions():
+    # selector -> (signature, input types, output types) for every ABI the app calls
+    functions = {}
+    abis = (valuation.staking_abi, valuation.lp_manager_abi, valuation.erc20_abi, valuation.multi_staking_abi,
+            valuation.pesw_presale_abi, valuation.pesw_staking_abi)
+    for abi in abis:
+        for fn in abi:
+            inputs = [_abi_type(p) for p in fn["inputs"]]
+            signature = f"{fn['name']}({','.join(inputs)})"
+            selector = "0x" + valuation.Web3.keccak(text=signature)[:4].hex().removeprefix("0x")
+            functions[selector] = (signature, inputs, [_abi_type(p) for p in fn["outputs"]])
+    return functions
+
+
+class Reverted(Exception):
+    pass
+
+
+class Node:
+    """Answers eth_call against the mock world, either directly or batched through Multicall3 aggregate3."""
+
+    def __init__(self, world):
+        self.world = world
+        self.functions = _functions()
+        self.multicall = multicall.MULTICALL3_ADDRESS.lower()
+        w = world
+        first_token = w.tokens[0]["address"]
+        self.handlers = {
+            "poolStakers(address)": lambda to, a: [_seed(w.seed, "staked", a[0]) % 10 ** 24, 0, 0, 0],
+            "getRewards(address)": lambda to, a: [_seed(w.seed, "rewards", a[0]) % 10 ** 21],
+            "positions(uint256)": lambda to, a: w.position(a[0]),
+            "factory()": lambda to, a: [_address(w.seed, "factory")],
+            "balanceOf(address)": lambda to, a: [_seed(w.seed, "balance", to, a[0]) % 10 ** 26],
+            "decimals()": lambda to, a: [self._token(to)["decimals"]],
+            "symbol()": lambda to, a: [self._token(to)["symbol"]],
+            "name()": lambda to, a: [self._token(to)["name"]],
+            "pools(uint256)": lambda to, a: [first_token, first_token, 1200, 0, 30 * 86400, True, True, 10 ** 24, True],
+            "stakes(uint256,address)": lambda to, a: [_seed(w.seed, "stake", a) % 10 ** 23, int(time.time()) - 86400, 0],
+            "pendingRewards(uint256,address)": lambda to, a: [_seed(w.seed, "pending", a) % 10 ** 20],
+            "getUserDeposits(bytes)": lambda to, a: [_seed(w.seed, "deposits", a[0]) % 10 ** 23],
+            "getPoolStakers(bytes)": lambda to, a: [_seed(w.seed, "pesw_staked", a[0]) % 10 ** 23, 0, 0, 0, 0],
+            "getRewards(bytes)": lambda to, a: [_seed(w.seed, "pesw_rewards", a[0]) % 10 ** 20],
+            "currentStep()": lambda to, a: [3],
+            "rounds(uint256,uint256)": lambda to, a: [10 ** 16],
+        }
+
+    def _token(self, address):
+        token = self.world.token_by_address.get(address)
+        if token is None:
+            raise Reverted()
+        return token
+
+    def _pool_call(self, to, selector, args):
+        # Raw pool reads the app makes without an ABI
+        pool = self.world.pool_by_address.get(to)
+        if pool is None:
+            raise Reverted()
+        if selector == valuation.SLOT0_SELECTOR:
+            return encode(["uint160", "int24", "uint16", "uint16", "uint16", "uint8", "bool"], [pool["sqrt_price_x96"], pool["tick"], 0, 1, 1, 0, True])
+        if selector == valuation.FEE_GROWTH_GLOBAL0_SELECTOR:
+            return encode(["uint256"], [pool["fee_growth_global0"]])
+        if selector == valuation.FEE_GROWTH_GLOBAL1_SELECTOR:
+            return encode(["uint256"], [pool["fee_growth_global1"]])
+        if selector == valuation.TICKS_SELECTOR:
+            # Fee growth outside of 0 on both sides keeps the in-range fee math simple
+            return encode(["uint128", "int128", "uint256", "uint256", "int56", "uint160", "uint32", "bool"], [1, 0, 0, 0, 0, 0, 0, True])
+        raise Reverted()
+
+    def call(self, to, data):
+        to = to.lower()
+        selector, args = "0x" + data[:4].hex(), data[4:]
+        if to == self.multicall and selector == AGGREGATE3_SELECTOR:
+            (calls,) = decode(["(address,bool,bytes)[]"], args)
+            results = []
+            for target, _, call_data in calls:
+                try:
+                    results.append((True, self.call(target, call_data)))
+                except Reverted:
+                    results.append((False, b""))
+            return encode(["(bool,bytes)[]"], [results])
+        if selector in (valuation.SLOT0_SELECTOR, valuation.FEE_GROWTH_GLOBAL0_SELECTOR, valuation.FEE_GROWTH_GLOBAL1_SELECTOR, valuation.TICKS_SELECTOR):
+            return self._pool_call(to, selector, args)
+        fn = self.functions.get(selector)
+        if fn is None:
+            raise Reverted()
+        signature, inputs, outputs = fn
+        values = decode(inputs, args)
+        return encode(outputs, self.handlers[signature](to, [v.lower() if isinstance(v, str) else v for v in values]))
+
+    def handle(self, request):
+        method, params = request.get("method"), request.get("params", [])
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        try:
+            if method == "eth_chainId":
+                result = hex(97741)
+            elif method == "eth_blockNumber":
+                result = hex(self.world.block_number())
+            elif method == "eth_getBalance":
+                result = hex(self.world.native_balance(params[0]))
+            elif method == "eth_getCode":
+                result = "0x6080" if params[0].lower() == self.multicall else "0x"
+            elif method == "eth_getLogs":
+                result = []
+            elif method == "eth_call":
+                result = "0x" + self.call(params[0]["to"], bytes.fromhex(params[0]["data"].removeprefix("0x"))).hex()
+            else:
+                response["error"] = {"code": -32601, "message": f"method {method} not supported by mock"}
+                return response
+        except Reverted:
+            response["error"] = {"code": 3, "message": "execution reverted", "data": "0x"}
+            return response
+        response["result"] = result
+        return response
+
+
+def rpc_app(world, faults):
+    app = FastAPI()
+    node = Node(world)
+
+    @app.post("/")
+    async def rpc(request: Request):
+        body = await request.json()
+        if isinstance(body, list):
+            return [node.handle(r) for r in body]
+        return node.handle(body)
+
+    return _with_faults(app, faults)
+
+
+async def serve(world, faults, host="127.0.0.1", rpc_port=8545, explorer_port=8546, gecko_port=8547):
+    servers = [
+        uvicorn.Server(uvicorn.Config(factory(world, faults), host=host, port=port, log_level="warning"))
+        for factory, port in ((rpc_app, rpc_port), (explorer_app, explorer_port), (geckoterminal_app, gecko_port))
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def urls(host, rpc_port, explorer_port, gecko_port):
+    return {
+        "RPC_URL": f"http://{host}:{rpc_port}",
+        "EXPLORER_API_URL": f"http://{host}:{explorer_port}/api/v2",
+        "GECKOTERMINAL_API_URL": f"http://{host}:{gecko_port}/api/v2",
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--rpc-port", type=int, default=8545)
+    parser.add_argument("--explorer-port", type=int, default=8546)
+    parser.add_argument("--gecko-port", type=int, default=8547)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every response")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="uniform +/- around --latency-ms")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument("--tokens-per-wallet", type=int, default=20)
+    parser.add_argument("--lps-per-wallet", type=int, default=4)
+    parser.add_argument("--nft-page-size", type=int, default=50)
+    parser.add_argument("--block-time", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=1)
+
+
+def from_arguments(args):
+    world = World(seed=args.seed, tokens_per_wallet=args.tokens_per_wallet, lps_per_wallet=args.lps_per_wallet,
+                  nft_page_size=args.nft_page_size, block_time=args.block_time)
+    return world, Faults(args.latency_ms, args.jitter_ms, args.failure_rate, args.rate_limit_rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local explorer, GeckoTerminal and JSON-RPC stand-ins")
+    add_arguments(parser)
+    args = parser.parse_args()
+    world, faults = from_arguments(args)
+    for name, url in urls(args.host, args.rpc_port, args.explorer_port, args.gecko_port).items():
+        print(f"{name}={url}", flush=True)
+    asyncio.run(serve(world, faults, args.host, args.rpc_port, args.explorer_port, args.gecko_port))
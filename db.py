@@ -0,0 +1,223 @@
+# === db.py ===
+
+import os
+from contextlib import asynccontextmanager
+import asyncpg
+import metrics
+
+DB_URL = os.getenv("DATABASE_URL")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+
+# Applied once, in order, and recorded in schema_migrations. Append new steps; never edit applied ones.
+MIGRATIONS = [
+    (1, """
+    CREATE TABLE IF NOT EXISTS wallet_history (
+        id SERIAL PRIMARY KEY,
+        wallet TEXT NOT NULL,
+        timestamp TIMESTAMPTZ DEFAULT NOW(),
+        pepu_usd DOUBLE PRECISION,
+        l2_usd DOUBLE PRECISION,
+        lp_usd DOUBLE PRECISION,
+        presale_usd DOUBLE PRECISION
+    );
+    CREATE TABLE IF NOT EXISTS tracked_wallets (
+        wallet TEXT PRIMARY KEY
+    );
+    """),
+    (2, """
+    CREATE TABLE IF NOT EXISTS token_metadata (
+        address TEXT PRIMARY KEY,
+        icon_url TEXT,
+        symbol TEXT,
+        decimals INTEGER,
+        last_checked TIMESTAMPTZ NOT NULL
+    );
+    """),
+    (3, """
+    CREATE TABLE IF NOT EXISTS price_cache (
+        address TEXT PRIMARY KEY,
+        price_usd DOUBLE PRECISION,
+        liquidity DOUBLE PRECISION,
+        volume_24h_usd DOUBLE PRECISION,
+        price_change_24h_percentage DOUBLE PRECISION,
+        icon_url TEXT,
+        price_ts DOUBLE PRECISION NOT NULL
+    );
+    """),
+    (4, """
+    CREATE TABLE IF NOT EXISTS lp_pools (
+        pool_address TEXT PRIMARY KEY,
+        token0 TEXT NOT NULL,
+        token1 TEXT NOT NULL,
+        symbol0 TEXT,
+        symbol1 TEXT,
+        decimals0 INTEGER,
+        decimals1 INTEGER,
+        fee INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS lp_position_pools (
+        token_id BIGINT PRIMARY KEY,
+        pool_address TEXT NOT NULL
+    );
+    """),
+    (5, """
+    CREATE TABLE IF NOT EXISTS indexer_checkpoints (
+        block BIGINT PRIMARY KEY,
+        hash TEXT NOT NULL,
+        indexed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    );
+    CREATE TABLE IF NOT EXISTS indexed_wallets (
+        wallet TEXT PRIMARY KEY,
+        synced_block BIGINT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS indexed_tokens (
+        address TEXT PRIMARY KEY,
+        name TEXT,
+        symbol TEXT,
+        decimals INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS token_holdings (
+        wallet TEXT NOT NULL,
+        token TEXT NOT NULL,
+        balance NUMERIC(78, 0) NOT NULL,
+        block BIGINT NOT NULL,
+        PRIMARY KEY (wallet, token)
+    );
+    CREATE TABLE IF NOT EXISTS lp_holdings (
+        token_id BIGINT PRIMARY KEY,
+        wallet TEXT NOT NULL,
+        liquidity NUMERIC(39, 0) NOT NULL,
+        block BIGINT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS lp_holdings_wallet_idx ON lp_holdings (wallet);
+    CREATE TABLE IF NOT EXISTS indexer_touches (
+        block BIGINT NOT NULL,
+        wallet TEXT,
+        token TEXT,
+        token_id BIGINT
+    );
+    CREATE INDEX IF NOT EXISTS indexer_touches_block_idx ON indexer_touches (block);
+    """),
+    (6, """
+    CREATE INDEX IF NOT EXISTS wallet_history_wallet_ts_idx ON wallet_history (wallet, timestamp);
+    CREATE TABLE IF NOT EXISTS wallet_history_rollups (
+        wallet TEXT NOT NULL,
+        resolution TEXT NOT NULL,
+        bucket TIMESTAMPTZ NOT NULL,
+        samples INTEGER NOT NULL,
+        pepu_usd DOUBLE PRECISION,
+        pepu_usd_min DOUBLE PRECISION,
+        pepu_usd_max DOUBLE PRECISION,
+        l2_usd DOUBLE PRECISION,
+        l2_usd_min DOUBLE PRECISION,
+        l2_usd_max DOUBLE PRECISION,
+        lp_usd DOUBLE PRECISION,
+        lp_usd_min DOUBLE PRECISION,
+        lp_usd_max DOUBLE PRECISION,
+        presale_usd DOUBLE PRECISION,
+        presale_usd_min DOUBLE PRECISION,
+        presale_usd_max DOUBLE PRECISION,
+        PRIMARY KEY (wallet, resolution, bucket)
+    );
+    CREATE TABLE IF NOT EXISTS wallet_history_rollup_state (
+        resolution TEXT PRIMARY KEY,
+        rolled_until TIMESTAMPTZ NOT NULL
+    );
+    """),
+    (7, """
+    CREATE TABLE IF NOT EXISTS history_cycles (
+        cycle_start TIMESTAMPTZ PRIMARY KEY,
+        wallets INTEGER NOT NULL,
+        created_by TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        completed_at TIMESTAMPTZ
+    );
+    CREATE TABLE IF NOT EXISTS history_cycle_wallets (
+        cycle_start TIMESTAMPTZ NOT NULL,
+        wallet TEXT NOT NULL,
+        claimed_by TEXT,
+        claimed_at TIMESTAMPTZ,
+        done BOOLEAN NOT NULL DEFAULT FALSE,
+        PRIMARY KEY (cycle_start, wallet)
+    );
+    CREATE INDEX IF NOT EXISTS history_cycle_wallets_open_idx ON history_cycle_wallets (cycle_start) WHERE NOT done;
+    """),
+    (8, """
+    CREATE TABLE IF NOT EXISTS indexer_retries (
+        wallet TEXT,
+        token TEXT,
+        token_id BIGINT
+    );
+    """),
+]
+
+# Arbitrary keys so concurrent workers do not run migrations, or the indexer, at the same time
+MIGRATION_LOCK_KEY = 7_100_001
+INDEXER_LOCK_KEY = 7_100_002
+
+pool = None
+
+
+async def migrate(conn):
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK_KEY)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                applied_at TIMESTAMPTZ DEFAULT NOW()
+            )
+        """)
+        applied = {r["version"] for r in await conn.fetch("SELECT version FROM schema_migrations")}
+        for version, sql in MIGRATIONS:
+            if version in applied:
+                continue
+            await conn.execute(sql)
+            await conn.execute("INSERT INTO schema_migrations (version) VALUES ($1)", version)
+            print(f"[DB] Applied migration {version}")
+
+
+async def _init_connection(conn):
+    # Per-statement latency and errors for /metrics
+    conn.add_query_logger(metrics.observe_query)
+
+
+async def connect():
+    global pool
+    if pool is not None:
+        return pool
+    try:
+        pool = await asyncpg.create_pool(DB_URL, min_size=DB_POOL_MIN, max_size=DB_POOL_MAX, init=_init_connection)
+        async with pool.acquire() as conn:
+            await migrate(conn)
+    except Exception as e:
+        print("[DB ERROR]", e)
+        if pool is not None:
+            await pool.close()
+        pool = None
+    return pool
+
+
+async def close():
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+
+def get_pool():
+    if pool is None:
+        raise RuntimeError("Database pool is not available")
+    return pool
+
+
+@asynccontextmanager
+async def try_advisory_lock(key):
+    # Yields whether this process got the session-level lock; held on a dedicated connection until the block exits
+    async with get_pool().acquire() as conn:
+        locked = await conn.fetchval("SELECT pg_try_advisory_lock($1)", key)
+        try:
+            yield locked
+        finally:
+            if locked:
+                await conn.execute("SELECT pg_advisory_unlock($1)", key)
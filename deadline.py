@@ -0,0 +1,90 @@
+# === deadline.py ===
+
+import os
+import time
+import asyncio
+import contextvars
+from contextlib import contextmanager
+
+# Server default for user-facing requests; clients can override with ?deadline_ms=
+DEFAULT_DEADLINE_MS = int(os.getenv("DEFAULT_DEADLINE_MS", "4000"))
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+TIMEOUT = object()
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    pass
+
+
+@contextmanager
+def budget(ms):
+    token = _deadline.set(time.monotonic() + ms / 1000)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def clear():
+    # For work that must outlive the request that started it (background refreshes)
+    _deadline.set(None)
+
+
+def remaining():
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def clamp_timeout(timeout):
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded()
+    return min(timeout, left)
+
+
+async def bounded(aw):
+    left = remaining()
+    if left is None:
+        return await aw
+    try:
+        return await asyncio.wait_for(aw, max(left, 0))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded()
+
+
+async def gather_sections(**aws):
+    # Run sections concurrently until the deadline; unfinished ones are cancelled and come back as TIMEOUT,
+    # failed ones as their exception
+    tasks = {name: asyncio.ensure_future(aw) for name, aw in aws.items()}
+    left = remaining()
+    _, pending = await asyncio.wait(tasks.values(), timeout=None if left is None else max(left, 0))
+    for task in pending:
+        task.cancel()
+
+    results = {}
+    for name, task in tasks.items():
+        if task in pending:
+            results[name] = TIMEOUT
+        elif task.exception() is not None:
+            results[name] = task.exception()
+        else:
+            results[name] = task.result()
+    return results
+
+
+def failed(value):
+    return value is TIMEOUT or isinstance(value, BaseException)
+
+
+def marker(section, value=TIMEOUT, status=None):
+    # Structured placeholder for a section that is missing from a partial response
+    if status is None:
+        status = "timeout" if value is TIMEOUT or isinstance(value, asyncio.TimeoutError) else "error"
+    entry = {"section": section, "status": status}
+    if status == "error":
+        entry["detail"] = repr(value)
+    return entry
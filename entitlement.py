@@ -0,0 +1,107 @@
+# === entitlement.py ===
+
+import os
+import time
+from collections import OrderedDict
+from eth_account import Account
+from eth_account.messages import encode_defunct
+from web3 import Web3
+from singleflight import SingleFlight
+import token_metadata
+import valuation
+
+MIN_REQUIRED_PBTC = 2_000_000
+PBTC_CONTRACT = "0x73d070ec589d9f889fdf3b16fb1b828cecef320b"
+
+# Dashboards poll /wallet-history with the same signed message; both the ECDSA recovery and the balance check
+# are remembered for a short while so repeat polls cost nothing
+SIGNATURE_CACHE_TTL = int(os.getenv("SIGNATURE_CACHE_TTL", "3600"))
+ENTITLEMENT_TTL = int(os.getenv("ENTITLEMENT_TTL", "60"))
+ENTITLEMENT_CACHE_MAX_ENTRIES = int(os.getenv("ENTITLEMENT_CACHE_MAX_ENTRIES", "10000"))
+
+
+class TTLCache:
+    """Bounded LRU whose entries expire `ttl` seconds after they were set."""
+
+    def __init__(self, ttl, max_entries=ENTITLEMENT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+_signers = TTLCache(SIGNATURE_CACHE_TTL)
+_entitlements = TTLCache(ENTITLEMENT_TTL)
+_checks = SingleFlight()
+
+
+def recover_signer(message, signature):
+    # Raises on a malformed signature; only successful recoveries are cached
+    key = (message, signature)
+    signer = _signers.get(key)
+    if signer is None:
+        signer = Account.recover_message(encode_defunct(text=message), signature=signature).lower()
+        _signers.set(key, signer)
+    return signer
+
+
+async def pbtc_balance(wallet):
+    # One balanceOf call; decimals come from the token metadata store after the first lookup
+    contract = valuation.erc20_contract(PBTC_CONTRACT)
+    decimals = token_metadata.decimals(PBTC_CONTRACT)
+    if decimals is None:
+        decimals = await contract.functions.decimals().call()
+        await token_metadata.save_decimals({PBTC_CONTRACT: decimals})
+    raw = await contract.functions.balanceOf(Web3.to_checksum_address(wallet)).call()
+    return raw / (10 ** decimals)
+
+
+async def check(message, signature):
+    """Returns (signer, error); error is None when the signer holds enough PBTC to view history."""
+    try:
+        signer = recover_signer(message, signature)
+    except Exception as e:
+        return None, f"Signature verification failed: {str(e)}"
+
+    key = (signer, message)
+    entitled = _entitlements.get(key)
+    if entitled is None:
+        async def fetch():
+            balance = await pbtc_balance(signer)
+            _entitlements.set(key, balance >= MIN_REQUIRED_PBTC)
+            return balance >= MIN_REQUIRED_PBTC
+
+        try:
+            entitled = await _checks.do(key, fetch)
+        except Exception as e:
+            print(f"[ENTITLEMENT ERROR] {signer}: {e}")
+            return signer, "Failed to verify wallet PBTC balance."
+
+    if not entitled:
+        return signer, f"Minimum {MIN_REQUIRED_PBTC:,} PBTC required to view history."
+    return signer, None
+
+
+def stats():
+    return {"signatures": _signers.stats(), "entitlements": _entitlements.stats(), "in_flight": _checks.in_flight()}
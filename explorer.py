@@ -0,0 +1,65 @@
+# === explorer.py ===
+
+import os
+import asyncio
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import upstream
+
+# Blockscout v2 listings return {"items": [...], "next_page_params": {...} | null}; some endpoints return a bare list
+EXPLORER_MAX_PAGES = int(os.getenv("EXPLORER_MAX_PAGES", "20"))
+
+
+def page_url(url, params):
+    # next_page_params are added to (or replace) the query of the first page's URL
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query.update({k: v for k, v in params.items() if v is not None})
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class Pages:
+    """Async iterator over an explorer listing, yielding each page's items as soon as it arrives.
+
+    The next page is requested before the current one is handed to the caller, so page fetches overlap with
+    whatever the caller does per page. Stops after `max_pages`; `truncated` tells whether more were available.
+    """
+
+    def __init__(self, url, max_pages=EXPLORER_MAX_PAGES, timeout=upstream.DEFAULT_TIMEOUT):
+        self.url = url
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.pages = 0
+        self.truncated = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        fetch = asyncio.ensure_future(upstream.get_json(self.url, timeout=self.timeout))
+        try:
+            while fetch is not None:
+                data = await fetch
+                fetch = None
+                self.pages += 1
+                if isinstance(data, list):
+                    yield data
+                    return
+                params = data.get("next_page_params")
+                if params:
+                    if self.pages < self.max_pages:
+                        fetch = asyncio.ensure_future(upstream.get_json(page_url(self.url, params), timeout=self.timeout))
+                    else:
+                        self.truncated = True
+                        print(f"[EXPLORER] Page cap ({self.max_pages}) reached for {self.url}")
+                yield data.get("items", [])
+        finally:
+            # Caller stopped early (error, deadline, break): do not leave the prefetch running
+            if fetch is not None and not fetch.done():
+                fetch.cancel()
+
+
+async def fetch_all(url, max_pages=EXPLORER_MAX_PAGES, timeout=upstream.DEFAULT_TIMEOUT):
+    items = []
+    async for page in Pages(url, max_pages, timeout):
+        items.extend(page)
+    return items
@@ -2,139 +2,331 @@
 
 import os
 import time
+import socket
 import asyncio
-import asyncpg
-from datetime import datetime
-import httpx
-from eth_account.messages import encode_defunct
-from eth_account import Account
-from web3 import Web3
-
-DB_URL = os.getenv("DATABASE_URL")
-MIN_REQUIRED_PBTC = 2_000_000
-PBTC_CONTRACT = "0x73d070ec589d9f889fdf3b16fb1b828cecef320b"
-
-# Run every 1 hour to log wallet data
+from itertools import groupby
+from operator import itemgetter
+from datetime import datetime, timedelta, timezone
+import db
+import entitlement
+import metrics
+import valuation
+
+HISTORY_CONCURRENCY = int(os.getenv("HISTORY_CONCURRENCY", "8"))
+# Cycle length, wallets per claim, and how long a claim is honoured before another worker may take it over
+HISTORY_INTERVAL = int(os.getenv("HISTORY_INTERVAL", str(60 * 60)))
+HISTORY_CLAIM_SIZE = int(os.getenv("HISTORY_CLAIM_SIZE", "50"))
+HISTORY_CLAIM_LEASE = int(os.getenv("HISTORY_CLAIM_LEASE", str(15 * 60)))
+HISTORY_POLL_INTERVAL = int(os.getenv("HISTORY_POLL_INTERVAL", "60"))
+
+# /wallet-history serves raw hourly rows for short ranges and day / week rollups for longer ones,
+# so a response never grows past a few hundred points per wallet
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "2000"))
+HISTORY_RESOLUTIONS = ("raw", "day", "week")
+RAW_MAX_SPAN = timedelta(days=14)
+DAILY_MAX_SPAN = timedelta(days=365)
+HISTORY_COMPONENTS = ("pepu_usd", "l2_usd", "lp_usd", "presale_usd")
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+# Value one wallet in-process: (pepu_usd, l2_usd, lp_usd, presale_usd)
+async def snapshot_wallet(wallet):
+    portfolio, lps, presales, staking = await asyncio.gather(
+        valuation.get_portfolio(wallet, log_mode=True),
+        valuation.get_lp_positions(wallet, log_mode=True),
+        valuation.get_presales(wallet),
+        valuation.get_staking(wallet, log_mode=True),
+    )
+    # A section that failed would be recorded as zero; skip the wallet this cycle instead
+    missing = [p["section"] for r in (portfolio, lps, presales, staking) for p in r.get("pending", [])]
+    if missing:
+        raise RuntimeError(f"incomplete valuation: {', '.join(missing)}")
+
+    pepu_usd = round(portfolio['native_pepu']['total_usd'] + portfolio['staked_pepu']['total_usd'] + portfolio['unclaimed_rewards']['total_usd'], 2)
+    l2_usd = round(sum(t['total_usd'] for t in portfolio['tokens']) + staking.get("total_value_usd", 0), 2)
+    lp_usd = round(lps.get("total_value_usd", 0), 2)
+    presale_usd = round(presales.get("total_value_usd", 0), 2)
+    return pepu_usd, l2_usd, lp_usd, presale_usd
+
+
+# One logging cycle's valuations: [(wallet, snapshot or None)], at most HISTORY_CONCURRENCY wallets at a time
+async def snapshot_wallets(wallets):
+    semaphore = asyncio.Semaphore(HISTORY_CONCURRENCY)
+
+    async def value_wallet(wallet):
+        async with semaphore:
+            try:
+                return wallet, await snapshot_wallet(wallet)
+            except Exception as e:
+                print(f"[ERROR] Logging wallet {wallet}: {e}")
+                return wallet, None
+
+    return await asyncio.gather(*(value_wallet(w) for w in wallets))
+
+
+# Every worker of every instance runs log_loop. Each hourly cycle is opened once, as a work table of all tracked
+# wallets; workers claim chunks of it and check each chunk off together with its rows, so the cycle is shared
+# instead of repeated, and a restarted worker picks up where the cycle left off. Claims older than the lease are
+# taken over by whoever polls next.
+async def _open_cycle(conn, worker):
+    async with conn.transaction():
+        cycle_start = await conn.fetchval(
+            "SELECT to_timestamp(floor(extract(epoch FROM NOW()) / $1::int) * $1::int)", HISTORY_INTERVAL
+        )
+        created = await conn.fetchval("""
+            INSERT INTO history_cycles (cycle_start, wallets, created_by) VALUES ($1, 0, $2)
+            ON CONFLICT (cycle_start) DO NOTHING
+            RETURNING cycle_start
+        """, cycle_start, worker)
+        if created:
+            await conn.execute("""
+                INSERT INTO history_cycle_wallets (cycle_start, wallet)
+                SELECT $1, wallet FROM tracked_wallets
+            """, cycle_start)
+            await conn.execute("""
+                UPDATE history_cycles SET wallets = (SELECT count(*) FROM history_cycle_wallets WHERE cycle_start = $1)
+                WHERE cycle_start = $1
+            """, cycle_start)
+            await conn.execute("DELETE FROM history_cycle_wallets WHERE cycle_start < $1 - INTERVAL '1 day'", cycle_start)
+    return cycle_start
+
+
+async def _claim(conn, cycle_start, worker):
+    rows = await conn.fetch("""
+        UPDATE history_cycle_wallets SET claimed_by = $2, claimed_at = NOW()
+        WHERE cycle_start = $1 AND wallet IN (
+            SELECT wallet FROM history_cycle_wallets
+            WHERE cycle_start = $1 AND NOT done
+              AND (claimed_at IS NULL OR claimed_at < NOW() - make_interval(secs => $3::int))
+            ORDER BY claimed_at NULLS FIRST, wallet
+            LIMIT $4
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING wallet
+    """, cycle_start, worker, HISTORY_CLAIM_LEASE, HISTORY_CLAIM_SIZE)
+    return [r["wallet"] for r in rows]
+
+
+async def _checkpoint(conn, cycle_start, snapshots):
+    # Rows and the done flags commit together; if a stolen chunk is finished twice, only the first one writes
+    async with conn.transaction():
+        done = {r["wallet"] for r in await conn.fetch("""
+            UPDATE history_cycle_wallets SET done = TRUE
+            WHERE cycle_start = $1 AND wallet = ANY($2::text[]) AND NOT done
+            RETURNING wallet
+        """, cycle_start, [wallet for wallet, _ in snapshots])}
+        # One COPY per chunk instead of an INSERT per wallet
+        records = [(wallet, *snapshot) for wallet, snapshot in snapshots if snapshot is not None and wallet in done]
+        if records:
+            await conn.copy_records_to_table(
+                "wallet_history",
+                records=records,
+                columns=["wallet", "pepu_usd", "l2_usd", "lp_usd", "presale_usd"],
+            )
+    return len(records)
+
+
+async def _complete(conn, cycle_start):
+    # Exactly one worker sees the last chunk checked off; it closes the cycle and runs the rollups
+    return await conn.fetchrow("""
+        UPDATE history_cycles SET completed_at = NOW()
+        WHERE cycle_start = $1 AND completed_at IS NULL
+          AND NOT EXISTS (SELECT 1 FROM history_cycle_wallets WHERE cycle_start = $1 AND NOT done)
+        RETURNING wallets, completed_at - created_at AS elapsed
+    """, cycle_start)
+
+
 async def log_loop():
+    worker = f"{socket.gethostname()}:{os.getpid()}"
     while True:
         try:
-            async with asyncpg.create_pool(DB_URL) as pool:
+            pool = db.get_pool()
+            async with pool.acquire() as conn:
+                cycle_start = await _open_cycle(conn, worker)
+
+            logged = claimed = 0
+            started = time.perf_counter()
+            while True:
+                async with pool.acquire() as conn:
+                    wallets = await _claim(conn, cycle_start, worker)
+                if not wallets:
+                    break
+                snapshots = await snapshot_wallets(wallets)
                 async with pool.acquire() as conn:
-                    await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS wallet_history (
-                        id SERIAL PRIMARY KEY,
-                        wallet TEXT NOT NULL,
-                        timestamp TIMESTAMPTZ DEFAULT NOW(),
-                        pepu_usd DOUBLE PRECISION,
-                        l2_usd DOUBLE PRECISION,
-                        lp_usd DOUBLE PRECISION,
-                        presale_usd DOUBLE PRECISION
-                    )
-                    """)
-
-                    await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS tracked_wallets (
-                        wallet TEXT PRIMARY KEY
-                    )
-                    """)
-
-                    rows = await conn.fetch("SELECT wallet FROM tracked_wallets")
-                    wallets = [r["wallet"] for r in rows]
-
-                    async with httpx.AsyncClient(timeout=30) as client:
-                        for wallet in wallets:
-                            try:
-                                res1 = await client.get(f"https://pepu-portfolio-tracker-test.onrender.com/portfolio?wallet={wallet}&log_mode=true")
-                                res2 = await client.get(f"https://pepu-portfolio-tracker-test.onrender.com/lp-positions?wallet={wallet}&log_mode=true")
-                                res3 = await client.get(f"https://pepu-portfolio-tracker-test.onrender.com/presales?wallet={wallet}")
-                                res4 = await client.get(f"https://pepu-portfolio-tracker-test.onrender.com/staking?wallet={wallet}&log_mode=true")
-
-                                portfolio = res1.json()
-                                lps = res2.json()
-                                presales = res3.json()
-                                staking = res4.json()
-
-                                pepu_usd = round(portfolio['native_pepu']['total_usd'] + portfolio['staked_pepu']['total_usd'] + portfolio['unclaimed_rewards']['total_usd'], 2)
-                                l2_usd = round(sum(t['total_usd'] for t in portfolio['tokens']) + staking.get("total_value_usd", 0), 2)
-                                lp_usd = round(lps.get("total_value_usd", 0), 2)
-                                presale_usd = round(presales.get("total_value_usd", 0), 2)
-
-                                await conn.execute("""
-                                    INSERT INTO wallet_history (wallet, pepu_usd, l2_usd, lp_usd, presale_usd)
-                                    VALUES ($1, $2, $3, $4, $5)
-                                """, wallet, pepu_usd, l2_usd, lp_usd, presale_usd)
-
-                            except Exception as e:
-                                print(f"[ERROR] Logging wallet {wallet}: {e}")
+                    logged += await _checkpoint(conn, cycle_start, snapshots)
+                claimed += len(wallets)
+
+            if claimed:
+                elapsed = time.perf_counter() - started
+                rate = claimed / elapsed if elapsed > 0 else 0.0
+                print(f"[HISTORY] {worker}: {logged}/{claimed} wallets logged in {elapsed:.1f}s ({rate:.2f} wallets/s, concurrency {HISTORY_CONCURRENCY})")
+
+            async with pool.acquire() as conn:
+                completed = await _complete(conn, cycle_start)
+            if completed:
+                elapsed = completed["elapsed"].total_seconds()
+                metrics.JOB_CYCLE_SECONDS.labels("history_log").observe(elapsed)
+                print(f"[HISTORY] Cycle {cycle_start.isoformat()} done: {completed['wallets']} wallets in {elapsed:.1f}s")
+
+                started = time.perf_counter()
+                await rollup_history()
+                metrics.JOB_CYCLE_SECONDS.labels("history_rollup").observe(time.perf_counter() - started)
 
         except Exception as e:
             print("[DB ERROR]", e)
 
-        await asyncio.sleep(1 * 60 * 60)  # every hour
+        # Short polls: a new cycle is picked up within a minute of the hour, and expired claims get taken over
+        await asyncio.sleep(HISTORY_POLL_INTERVAL)
 
 
 def record_wallet_history():
     return log_loop()
 
 
-async def get_wallet_history(wallets_str: str, message: str, signature: str):
+# Recompute every day / week bucket that received rows since the previous rollup (last / min / max per component)
+_ROLLUP_SQL = """
+    INSERT INTO wallet_history_rollups (wallet, resolution, bucket, samples, {columns})
+    SELECT wallet, $1, date_trunc($1, timestamp, 'UTC') AS bucket, count(*), {aggregates}
+    FROM wallet_history
+    WHERE timestamp >= date_trunc($1, $2::timestamptz - INTERVAL '1 hour', 'UTC')
+    GROUP BY wallet, bucket
+    ON CONFLICT (wallet, resolution, bucket) DO UPDATE SET samples = EXCLUDED.samples, {updates}
+""".format(
+    columns=", ".join(f"{c}, {c}_min, {c}_max" for c in HISTORY_COMPONENTS),
+    aggregates=", ".join(f"(array_agg({c} ORDER BY timestamp DESC))[1], min({c}), max({c})" for c in HISTORY_COMPONENTS),
+    updates=", ".join(f"{col} = EXCLUDED.{col}" for c in HISTORY_COMPONENTS for col in (c, f"{c}_min", f"{c}_max")),
+)
+
+
+async def rollup_history():
+    pool = db.get_pool()
+    async with pool.acquire() as conn:
+        for resolution in HISTORY_RESOLUTIONS[1:]:
+            async with conn.transaction():
+                now = await conn.fetchval("SELECT NOW()")
+                since = await conn.fetchval("SELECT rolled_until FROM wallet_history_rollup_state WHERE resolution = $1", resolution)
+                await conn.execute(_ROLLUP_SQL, resolution, since or datetime.min.replace(tzinfo=timezone.utc) + timedelta(days=1))
+                await conn.execute("""
+                    INSERT INTO wallet_history_rollup_state (resolution, rolled_until) VALUES ($1, $2)
+                    ON CONFLICT (resolution) DO UPDATE SET rolled_until = EXCLUDED.rolled_until
+                """, resolution, now)
+
+
+def pick_resolution(span):
+    if span <= RAW_MAX_SPAN:
+        return "raw"
+    if span <= DAILY_MAX_SPAN:
+        return "day"
+    return "week"
+
+
+def _utc(ts):
+    if ts is None or ts.tzinfo is not None:
+        return ts
+    return ts.replace(tzinfo=timezone.utc)
+
+
+def encode_cursor(resolution, wallet, ts):
+    # The resolution travels with the cursor so "auto" cannot switch tables between pages
+    return f"{resolution}:{wallet}:{(ts - EPOCH) // timedelta(microseconds=1)}"
+
+
+def decode_cursor(cursor):
+    # (resolution, (wallet, timestamp))
+    resolution, wallet, micros = (cursor.split(":") + ["", ""])[:3]
+    if resolution not in HISTORY_RESOLUTIONS or not wallet.startswith("0x") or not micros:
+        raise ValueError(cursor)
+    return resolution, (wallet, EPOCH + timedelta(microseconds=int(micros)))
+
+
+async def query_history(conn, wallets, start, end, resolution, after, limit, columnar=False):
+    # Keyset pagination over (wallet, time): each page starts right after the last row of the previous one
+    if resolution == "raw":
+        table, ts_col, extra, columns = "wallet_history", "timestamp", "", HISTORY_COMPONENTS
+    else:
+        table, ts_col, extra = "wallet_history_rollups", "bucket", "AND resolution = $6"
+        columns = ("samples",) + tuple(col for c in HISTORY_COMPONENTS for col in (c, f"{c}_min", f"{c}_max"))
+    args = [wallets, start, end, after[0] if after else None, after[1] if after else None]
+    if resolution != "raw":
+        args.append(resolution)
+
+    rows = await conn.fetch(f"""
+        SELECT wallet, {ts_col} AS ts, EXTRACT(EPOCH FROM {ts_col})::bigint AS epoch, {", ".join(columns)}
+        FROM {table}
+        WHERE wallet = ANY($1::text[])
+          AND ($2::timestamptz IS NULL OR {ts_col} >= $2)
+          AND ($3::timestamptz IS NULL OR {ts_col} < $3)
+          AND ($4::text IS NULL OR (wallet, {ts_col}) > ($4, $5::timestamptz))
+          {extra}
+        ORDER BY wallet, {ts_col}
+        LIMIT {int(limit) + 1}
+    """, *args)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(resolution, rows[-1]["wallet"], rows[-1]["ts"])
+
+    if columnar:
+        # One array per field taken straight off the records, epoch-second timestamps computed by Postgres
+        history = {}
+        for wallet, group in groupby(rows, key=itemgetter("wallet")):
+            group = list(group)
+            fields = {"timestamp": [r["epoch"] for r in group]}
+            fields.update((col, [r[col] for r in group]) for col in columns)
+            history[wallet] = fields
+        return history, next_cursor
+
+    history = {}
+    for row in rows:
+        point = {"timestamp": row["ts"].isoformat()}
+        point.update((col, row[col]) for col in columns)
+        history.setdefault(row["wallet"], []).append(point)
+    return history, next_cursor
+
+
+async def get_wallet_history(wallets_str: str, message: str, signature: str, start=None, end=None, resolution="auto", cursor=None, limit=HISTORY_PAGE_SIZE, columnar=False):
+    # Returns (body, page); page carries the resolution used and the keyset cursor for the next page
     wallets = [w.strip().lower() for w in wallets_str.split(",") if w.strip().startswith("0x")]
     if not wallets:
-        return {"error": "No valid wallet addresses provided."}
-
-    try:
-        encoded = encode_defunct(text=message)
-        recovered = Account.recover_message(encoded, signature=signature)
-    except Exception as e:
-        return {"error": f"Signature verification failed: {str(e)}"}
-
-    # Verify PBTC balance from /portfolio
-    async with httpx.AsyncClient(timeout=30) as client:
-        res = await client.get(f"https://pepu-portfolio-tracker-test.onrender.com/portfolio?wallet={recovered}")
-        if res.status_code != 200:
-            return {"error": "Failed to verify wallet PBTC balance."}
-        data = res.json()
-        tokens = data.get("tokens", [])
-
-        pbtc_token = next((t for t in tokens if t.get("contract", "").lower() == PBTC_CONTRACT), None)
-        total_pbtc = pbtc_token.get("amount", 0) if pbtc_token else 0
-
-    if total_pbtc < MIN_REQUIRED_PBTC:
-        return {"error": f"Minimum {MIN_REQUIRED_PBTC:,} PBTC required to view history."}
-
-    # Add all requested wallets to tracked_wallets
-    async with asyncpg.create_pool(DB_URL) as pool:
-        async with pool.acquire() as conn:
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS tracked_wallets (
-                    wallet TEXT PRIMARY KEY
-                )
-            """)
-            for w in wallets:
-                await conn.execute("INSERT INTO tracked_wallets (wallet) VALUES ($1) ON CONFLICT DO NOTHING", w)
-
-    async with asyncpg.create_pool(DB_URL) as pool:
-        async with pool.acquire() as conn:
-            rows = await conn.fetch("""
-                SELECT wallet, timestamp, pepu_usd, l2_usd, lp_usd, presale_usd
-                FROM wallet_history
-                WHERE wallet = ANY($1::text[])
-                ORDER BY timestamp ASC
+        return {"error": "No valid wallet addresses provided."}, None
+
+    # Signer must hold enough PBTC; cached per (signer, message), one balanceOf call otherwise
+    _, error = await entitlement.check(message, signature)
+    if error:
+        return {"error": error}, None
+
+    if resolution not in HISTORY_RESOLUTIONS and resolution != "auto":
+        return {"error": f"resolution must be one of auto, {', '.join(HISTORY_RESOLUTIONS)}."}, None
+    after = None
+    if cursor:
+        try:
+            cursor_resolution, after = decode_cursor(cursor)
+        except ValueError:
+            return {"error": "Invalid cursor."}, None
+        if resolution == "auto":
+            resolution = cursor_resolution
+        elif resolution != cursor_resolution:
+            return {"error": f"Cursor was issued for resolution {cursor_resolution}, not {resolution}."}, None
+
+    start, end = _utc(start), _utc(end)
+    pool = db.get_pool()
+    async with pool.acquire() as conn:
+        # Add all requested wallets to tracked_wallets
+        await conn.execute("""
+            INSERT INTO tracked_wallets (wallet)
+            SELECT unnest($1::text[])
+            ON CONFLICT DO NOTHING
+        """, wallets)
+
+        if resolution == "auto":
+            first = start or await conn.fetchval("""
+                SELECT min(f.timestamp)
+                FROM unnest($1::text[]) AS w(wallet),
+                LATERAL (SELECT timestamp FROM wallet_history h WHERE h.wallet = w.wallet ORDER BY timestamp LIMIT 1) f
             """, wallets)
+            resolution = pick_resolution((end or datetime.now(timezone.utc)) - first) if first else "raw"
 
-    history = {}
-    for row in rows:
-        wallet = row["wallet"]
-        if wallet not in history:
-            history[wallet] = []
-        history[wallet].append({
-            "timestamp": row["timestamp"].isoformat(),
-            "pepu_usd": row["pepu_usd"],
-            "l2_usd": row["l2_usd"],
-            "lp_usd": row["lp_usd"],
-            "presale_usd": row["presale_usd"]
-        })
-
-    return history
-
-    return {"status": "ok"}
+        history, next_cursor = await query_history(conn, wallets, start, end, resolution, after, limit, columnar)
+
+    return history, {"resolution": resolution, "next_cursor": next_cursor}
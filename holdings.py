@@ -0,0 +1,73 @@
+# === holdings.py ===
+
+import os
+import time
+import db
+
+# Read side of the holdings indexer (see indexer.py). A wallet is served from the index only while the
+# indexer is keeping up; otherwise callers fall back to the explorer.
+INDEXER_MAX_LAG_BLOCKS = int(os.getenv("INDEXER_MAX_LAG_BLOCKS", "10"))
+INDEXER_MAX_LAG_SECONDS = float(os.getenv("INDEXER_MAX_LAG_SECONDS", "60"))
+# How long the checkpoint / synced-wallet view is reused before asking Postgres again
+HOLDINGS_STATE_TTL = float(os.getenv("HOLDINGS_STATE_TTL", "2"))
+
+_state = {"block": None, "indexed_at": 0.0, "wallets": frozenset(), "loaded": 0.0}
+
+
+async def _refresh_state():
+    async with db.pool.acquire() as conn:
+        checkpoint = await conn.fetchrow("SELECT block, indexed_at FROM indexer_checkpoints ORDER BY block DESC LIMIT 1")
+        wallets = await conn.fetch("SELECT wallet FROM indexed_wallets")
+    _state["block"] = checkpoint["block"] if checkpoint else None
+    _state["indexed_at"] = checkpoint["indexed_at"].timestamp() if checkpoint else 0.0
+    _state["wallets"] = frozenset(r["wallet"] for r in wallets)
+    _state["loaded"] = time.time()
+
+
+def invalidate():
+    _state["loaded"] = 0.0
+
+
+async def ready(wallet, block_identifier="latest"):
+    if db.pool is None:
+        return False
+    try:
+        if time.time() - _state["loaded"] > HOLDINGS_STATE_TTL:
+            await _refresh_state()
+    except Exception as e:
+        print(f"[HOLDINGS] State unavailable: {repr(e)}")
+        return False
+    if _state["block"] is None or wallet.lower() not in _state["wallets"]:
+        return False
+    if time.time() - _state["indexed_at"] > INDEXER_MAX_LAG_SECONDS:
+        return False
+    if isinstance(block_identifier, int) and block_identifier - _state["block"] > INDEXER_MAX_LAG_BLOCKS:
+        return False
+    return True
+
+
+async def token_balances(wallet):
+    # Same shape as the explorer's token-balances items, so valuation code does not care where they came from
+    rows = await db.pool.fetch("""
+        SELECT h.token, h.balance, t.name, t.symbol, t.decimals
+        FROM token_holdings h
+        LEFT JOIN indexed_tokens t ON t.address = h.token
+        WHERE h.wallet = $1 AND h.balance > 0
+    """, wallet.lower())
+    return [
+        {
+            "token": {
+                "address": r["token"],
+                "name": r["name"],
+                "symbol": r["symbol"],
+                "decimals": str(r["decimals"]) if r["decimals"] is not None else None,
+            },
+            "value": str(r["balance"]),
+        }
+        for r in rows
+    ]
+
+
+async def lp_token_ids(wallet):
+    rows = await db.pool.fetch("SELECT token_id FROM lp_holdings WHERE wallet = $1 ORDER BY token_id", wallet.lower())
+    return [r["token_id"] for r in rows]
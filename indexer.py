@@ -0,0 +1,315 @@
+# === indexer.py ===
+
+import os
+import time
+import asyncio
+from web3 import Web3
+import db
+import explorer
+import holdings
+import metrics
+import multicall
+import valuation
+
+# Follows chain logs for tracked wallets and keeps token balances and LP position sets in Postgres.
+# Logs only say *what* changed; balances, owners and liquidity are then read at the checkpoint block, so the
+# stored state is always exactly the chain state at that block and a reorg is handled by re-reading.
+INDEXER_ENABLED = os.getenv("INDEXER_ENABLED", "1") == "1"
+INDEXER_INTERVAL = float(os.getenv("INDEXER_INTERVAL", "5"))
+INDEXER_BATCH_BLOCKS = int(os.getenv("INDEXER_BATCH_BLOCKS", "2000"))
+INDEXER_CONFIRMATIONS = int(os.getenv("INDEXER_CONFIRMATIONS", "0"))
+# Checkpoints and touched keys are kept this many blocks back, to find a common ancestor after a reorg
+INDEXER_REORG_DEPTH = int(os.getenv("INDEXER_REORG_DEPTH", "64"))
+# Wallets per eth_getLogs topic filter
+INDEXER_TOPIC_CHUNK = int(os.getenv("INDEXER_TOPIC_CHUNK", "100"))
+# Calls per Multicall round when reading balances and positions
+INDEXER_READ_BATCH = int(os.getenv("INDEXER_READ_BATCH", "300"))
+
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+INCREASE_LIQUIDITY_TOPIC = "0x3067048beee31b25b2f1681f88dac838c8bba36af25bfb2b7cf7473a5847e35f"
+DECREASE_LIQUIDITY_TOPIC = "0x26f6a048ee9138f2c0ce266f322cb99228e8d619ae2bff30c67f8dcf9d2377b4"
+
+web3 = valuation.web3
+
+
+def _topic(address):
+    return "0x" + "0" * 24 + address.lower()[2:]
+
+
+def _address(topic):
+    return "0x" + bytes(topic)[-20:].hex()
+
+
+async def _block_hash(number):
+    return (await web3.eth.get_block(number))["hash"].hex()
+
+
+async def _get_logs(from_block, to_block, wallets):
+    transfers = []
+    for i in range(0, len(wallets), INDEXER_TOPIC_CHUNK):
+        topics = [_topic(w) for w in wallets[i:i + INDEXER_TOPIC_CHUNK]]
+        transfers += await web3.eth.get_logs({"fromBlock": from_block, "toBlock": to_block, "topics": [TRANSFER_TOPIC, topics]})
+        transfers += await web3.eth.get_logs({"fromBlock": from_block, "toBlock": to_block, "topics": [TRANSFER_TOPIC, None, topics]})
+    liquidity = await web3.eth.get_logs({
+        "fromBlock": from_block,
+        "toBlock": to_block,
+        "address": Web3.to_checksum_address(valuation.LP_MANAGER_ADDRESS),
+        "topics": [[INCREASE_LIQUIDITY_TOPIC, DECREASE_LIQUIDITY_TOPIC]],
+    })
+    return transfers, liquidity
+
+
+def _touches(transfers, liquidity, wallets, held_ids):
+    # (wallet, token) pairs whose ERC-20 balance may have changed, and LP token IDs whose owner or liquidity may have
+    pairs, token_ids = set(), set()
+    for log in transfers:
+        contract = log["address"].lower()
+        parties = [_address(log["topics"][1]), _address(log["topics"][2])]
+        if len(log["topics"]) == 4:
+            # ERC-721 Transfer (tokenId indexed); only LP positions matter
+            if contract == valuation.LP_MANAGER_ADDRESS:
+                token_ids.add(int.from_bytes(bytes(log["topics"][3]), "big"))
+        elif len(log["topics"]) == 3:
+            pairs.update((party, contract) for party in parties if party in wallets)
+    for log in liquidity:
+        token_id = int.from_bytes(bytes(log["topics"][1]), "big")
+        if token_id in held_ids:
+            token_ids.add(token_id)
+    return pairs, token_ids
+
+
+async def _read_state(pairs, token_ids, block):
+    # Balances, owners and liquidity at `block`, in Multicall rounds of at most INDEXER_READ_BATCH calls.
+    # Also returns the pairs and token IDs whose reads failed for a reason other than an on-chain revert
+    # (a failed round, a missing or undecodable response); those are left out of the result and retried.
+    pairs, token_ids = sorted(pairs), sorted(token_ids)
+    lp = valuation.lp_contract.functions
+    calls = [valuation.erc20_contract(token).functions.balanceOf(Web3.to_checksum_address(wallet)) for wallet, token in pairs]
+    calls += [call for token_id in token_ids for call in (lp.ownerOf(token_id), lp.positions(token_id))]
+    results = []
+    for i in range(0, len(calls), INDEXER_READ_BATCH):
+        results += await valuation.rpc_batcher.call(calls[i:i + INDEXER_READ_BATCH], block)
+
+    balances, retry_pairs = {}, set()
+    for key, res in zip(pairs, results):
+        if res.success:
+            balances[key] = res.value
+        elif multicall.reverted(res):
+            # A token whose balanceOf reverts keeps its last known balance rather than stalling the whole index
+            print(f"[INDEXER] balanceOf reverted for {key}: {repr(res.error)}")
+        else:
+            retry_pairs.add(key)
+    positions, retry_ids = {}, set()
+    offset = len(pairs)
+    for i, token_id in enumerate(token_ids):
+        owner_res, pos_res = results[offset + 2 * i], results[offset + 2 * i + 1]
+        if owner_res.success and pos_res.success:
+            positions[token_id] = (owner_res.value.lower(), pos_res.value)
+        elif multicall.reverted(owner_res):
+            # ownerOf reverts for burned positions; that is the only failure that proves the position is gone
+            positions[token_id] = None
+        else:
+            retry_ids.add(token_id)
+    if retry_pairs or retry_ids:
+        print(f"[INDEXER] {len(retry_pairs)} balance and {len(retry_ids)} position reads failed; retrying next batch")
+    return balances, positions, retry_pairs, retry_ids
+
+
+async def _token_info(tokens):
+    # name / symbol / decimals for tokens the index has not seen, from one Multicall round
+    tokens = sorted(tokens)
+    calls = [fn() for token in tokens for fn in (
+        valuation.erc20_contract(token).functions.name,
+        valuation.erc20_contract(token).functions.symbol,
+        valuation.erc20_contract(token).functions.decimals,
+    )]
+    results = await valuation.rpc_batcher.call(calls)
+    info = {}
+    for i, token in enumerate(tokens):
+        name, symbol, decimals = (res.value if res.success else None for res in results[3 * i:3 * i + 3])
+        info[token] = (name, symbol, decimals)
+    return info
+
+
+async def _write(conn, block, block_hash, balances, positions, wallets, token_info, touched_pairs, touched_ids):
+    await conn.executemany("""
+        INSERT INTO indexed_tokens (address, name, symbol, decimals) VALUES ($1, $2, $3, $4)
+        ON CONFLICT (address) DO NOTHING
+    """, [(token, *info) for token, info in token_info.items()])
+
+    await conn.executemany("DELETE FROM token_holdings WHERE wallet = $1 AND token = $2", [key for key, bal in balances.items() if bal == 0])
+    await conn.executemany("""
+        INSERT INTO token_holdings (wallet, token, balance, block) VALUES ($1, $2, $3, $4)
+        ON CONFLICT (wallet, token) DO UPDATE SET balance = EXCLUDED.balance, block = EXCLUDED.block
+    """, [(wallet, token, bal, block) for (wallet, token), bal in balances.items() if bal != 0])
+
+    owned = {token_id: state for token_id, state in positions.items() if state is not None and state[0] in wallets}
+    await conn.executemany("DELETE FROM lp_holdings WHERE token_id = $1", [(token_id,) for token_id in positions if token_id not in owned])
+    await conn.executemany("""
+        INSERT INTO lp_holdings (token_id, wallet, liquidity, block) VALUES ($1, $2, $3, $4)
+        ON CONFLICT (token_id) DO UPDATE SET wallet = EXCLUDED.wallet, liquidity = EXCLUDED.liquidity, block = EXCLUDED.block
+    """, [(token_id, owner, pos[7], block) for token_id, (owner, pos) in owned.items()])
+
+    await conn.executemany(
+        "INSERT INTO indexer_touches (block, wallet, token, token_id) VALUES ($1, $2, $3, $4)",
+        [(block, wallet, token, None) for wallet, token in touched_pairs] + [(block, None, None, token_id) for token_id in touched_ids],
+    )
+    await conn.execute("""
+        INSERT INTO indexer_checkpoints (block, hash) VALUES ($1, $2)
+        ON CONFLICT (block) DO UPDATE SET hash = EXCLUDED.hash, indexed_at = NOW()
+    """, block, block_hash)
+    await conn.execute("DELETE FROM indexer_checkpoints WHERE block < $1", block - INDEXER_REORG_DEPTH)
+    await conn.execute("DELETE FROM indexer_touches WHERE block < $1", block - INDEXER_REORG_DEPTH)
+
+
+async def _rewind(conn):
+    # Returns (checkpoint block, keys touched in orphaned blocks) after undoing any reorg past the checkpoint
+    checkpoints = await conn.fetch("SELECT block, hash FROM indexer_checkpoints ORDER BY block DESC")
+    for i, cp in enumerate(checkpoints):
+        if await _block_hash(cp["block"]) == cp["hash"]:
+            if i == 0:
+                return cp["block"], set(), set()
+            print(f"[INDEXER] Reorg detected, rewinding from {checkpoints[0]['block']} to {cp['block']}")
+            rows = await conn.fetch("SELECT wallet, token, token_id FROM indexer_touches WHERE block > $1", cp["block"])
+            await conn.execute("DELETE FROM indexer_touches WHERE block > $1", cp["block"])
+            await conn.execute("DELETE FROM indexer_checkpoints WHERE block > $1", cp["block"])
+            pairs = {(r["wallet"], r["token"]) for r in rows if r["token"] is not None}
+            token_ids = {r["token_id"] for r in rows if r["token_id"] is not None}
+            return cp["block"], pairs, token_ids
+    if checkpoints:
+        # Deeper than the journal: start over and re-seed every wallet
+        print(f"[INDEXER] Reorg deeper than {INDEXER_REORG_DEPTH} blocks, re-seeding")
+        await conn.execute("TRUNCATE indexer_checkpoints, indexer_touches, indexer_retries, indexed_wallets, token_holdings, lp_holdings")
+    return None, set(), set()
+
+
+async def _seed(wallets):
+    # First sight of a wallet: the explorer says which tokens and LP NFTs to look at; the chain says how much.
+    # Returns LP token IDs per wallet, so a wallet whose reads fail can be left unsynced, and the wallets whose
+    # listing failed or was cut off at the page cap, which are not synced this time either.
+    pairs, token_ids, token_info, incomplete = set(), {}, {}, set()
+    for wallet in wallets:
+        wallet_pairs, wallet_ids, wallet_info = set(), set(), {}
+        try:
+            balances = explorer.Pages(valuation.TOKEN_BALANCE_API.format(wallet))
+            async for page in balances:
+                for item in page:
+                    token = item.get("token", {})
+                    address = token.get("address", "").lower()
+                    if not address or address == valuation.LP_MANAGER_ADDRESS or token.get("type", "ERC-20") != "ERC-20":
+                        continue
+                    wallet_pairs.add((wallet, address))
+                    decimals = token.get("decimals")
+                    wallet_info[address] = (token.get("name"), token.get("symbol"), int(decimals) if decimals else None)
+            nfts = explorer.Pages(valuation.NFT_API.format(wallet))
+            async for page in nfts:
+                wallet_ids.update(
+                    int(item["id"]) for item in page
+                    if item.get("token", {}).get("address", "").lower() == valuation.LP_MANAGER_ADDRESS
+                )
+        except Exception as e:
+            print(f"[INDEXER] Explorer listing failed for {wallet}, not seeding it yet: {repr(e)}")
+            incomplete.add(wallet)
+            continue
+        if balances.truncated or nfts.truncated:
+            incomplete.add(wallet)
+        pairs |= wallet_pairs
+        token_ids[wallet] = wallet_ids
+        token_info.update(wallet_info)
+    return pairs, token_ids, token_info, incomplete
+
+
+async def index_once():
+    pool = db.get_pool()
+    head = await web3.eth.block_number
+    target = head - INDEXER_CONFIRMATIONS
+
+    async with pool.acquire() as conn:
+        checkpoint, pairs, token_ids = await _rewind(conn)
+        if checkpoint is None:
+            checkpoint = int(os.getenv("INDEXER_START_BLOCK", target))
+        tracked = {r["wallet"] for r in await conn.fetch("SELECT wallet FROM tracked_wallets")}
+        synced = {r["wallet"] for r in await conn.fetch("SELECT wallet FROM indexed_wallets")}
+        held_ids = {r["token_id"] for r in await conn.fetch("SELECT token_id FROM lp_holdings")}
+        known_tokens = {r["address"] for r in await conn.fetch("SELECT address FROM indexed_tokens")}
+        # Reads that failed last batch are done again at this one's block
+        for r in await conn.fetch("SELECT wallet, token, token_id FROM indexer_retries"):
+            if r["token_id"] is not None:
+                token_ids.add(r["token_id"])
+            else:
+                pairs.add((r["wallet"], r["token"]))
+
+    to_block = min(target, checkpoint + INDEXER_BATCH_BLOCKS)
+    wallets = sorted(tracked)
+    seeding = sorted(tracked - synced)
+    token_info = {}
+
+    if to_block > checkpoint:
+        to_hash = await _block_hash(to_block)
+        transfers, liquidity = await _get_logs(checkpoint + 1, to_block, wallets)
+        # Logs and hash must come from the same fork; if the tip moved under us, try again next cycle
+        if await _block_hash(to_block) != to_hash:
+            return checkpoint
+        log_pairs, log_ids = _touches(transfers, liquidity, tracked, held_ids)
+        pairs |= log_pairs
+        token_ids |= log_ids
+    else:
+        to_block = checkpoint
+        to_hash = await _block_hash(to_block)
+        if not seeding and not pairs and not token_ids:
+            return checkpoint
+
+    seed_ids, unsynced = {}, set()
+    if seeding:
+        seed_pairs, seed_ids, token_info, unsynced = await _seed(seeding)
+        pairs |= seed_pairs
+        token_ids = token_ids.union(*seed_ids.values())
+
+    balances, positions, retry_pairs, retry_ids = await _read_state(pairs, token_ids, to_block)
+    # A new wallet is only marked synced once its listing was complete and every one of its reads succeeded;
+    # until then /portfolio keeps using the explorer for it and the next cycle seeds it again
+    unsynced |= {wallet for wallet, _ in retry_pairs} | {wallet for wallet, ids in seed_ids.items() if ids & retry_ids}
+    synced_now = [wallet for wallet in seeding if wallet not in unsynced]
+    if len(synced_now) < len(seeding):
+        print(f"[INDEXER] {len(seeding) - len(synced_now)} new wallets had failed reads; not marking them synced")
+    new_tokens = {token for _, token in pairs} - known_tokens - set(token_info)
+    if new_tokens:
+        token_info.update(await _token_info(new_tokens))
+    # LP positions first seen through logs have no NFT description; resolve their pool via the factory instead
+    await valuation.resolve_position_pools({token_id: state[1] for token_id, state in positions.items() if state is not None and state[0] in tracked}, to_block)
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await _write(conn, to_block, to_hash, balances, positions, tracked, token_info, pairs, token_ids)
+            await conn.execute("DELETE FROM indexer_retries")
+            await conn.executemany(
+                "INSERT INTO indexer_retries (wallet, token, token_id) VALUES ($1, $2, $3)",
+                [(wallet, token, None) for wallet, token in retry_pairs] + [(None, None, token_id) for token_id in retry_ids],
+            )
+            await conn.executemany(
+                "INSERT INTO indexed_wallets (wallet, synced_block) VALUES ($1, $2) ON CONFLICT (wallet) DO NOTHING",
+                [(wallet, to_block) for wallet in synced_now],
+            )
+    holdings.invalidate()
+    return to_block
+
+
+async def index_loop():
+    while True:
+        try:
+            started = time.perf_counter()
+            # One batch at a time across all workers and instances; whoever holds the lock runs it, the others skip
+            async with db.try_advisory_lock(db.INDEXER_LOCK_KEY) as leader:
+                block = await index_once() if leader else None
+            if block is None:
+                await asyncio.sleep(INDEXER_INTERVAL)
+                continue
+            metrics.JOB_CYCLE_SECONDS.labels("indexer").observe(time.perf_counter() - started)
+            head = await web3.eth.block_number
+            if head - block > INDEXER_BATCH_BLOCKS:
+                # Catching up: go again right away
+                print(f"[INDEXER] At block {block}, {head - block} behind ({time.perf_counter() - started:.2f}s per batch)")
+                continue
+        except Exception as e:
+            print(f"[INDEXER ERROR] {repr(e)}")
+        await asyncio.sleep(INDEXER_INTERVAL)
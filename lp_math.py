@@ -0,0 +1,110 @@
+# === lp_math.py ===
+
+import numpy as np
+
+# Uniswap V3 position math. position_amounts() values many positions in one NumPy pass (float64, ~1e-10 relative
+# error); the integer functions are exact ports of TickMath / SqrtPriceMath / LiquidityAmounts for verification.
+
+Q96 = 2 ** 96
+Q128 = 2 ** 128
+Q256 = 2 ** 256
+MIN_TICK = -887272
+MAX_TICK = 887272
+# ln(1.0001) / 2 via log1p: 1.0001 itself is not exact in binary, and the error grows with |tick|
+_HALF_LOG_TICK_BASE = np.log1p(1e-4) / 2
+
+# TickMath.getSqrtRatioAtTick: multipliers for each bit of |tick|
+_TICK_MULTIPLIERS = [
+    (0x2, 0xfff97272373d413259a46990580e213a),
+    (0x4, 0xfff2e50f5f656932ef12357cf3c7fdcc),
+    (0x8, 0xffe5caca7e10e4e61c3624eaa0941cd0),
+    (0x10, 0xffcb9843d60f6159c9db58835c926644),
+    (0x20, 0xff973b41fa98c081472e6896dfb254c0),
+    (0x40, 0xff2ea16466c96a3843ec78b326b52861),
+    (0x80, 0xfe5dee046a99a2a811c461f1969c3053),
+    (0x100, 0xfcbe86c7900a88aedcffc83b479aa3a4),
+    (0x200, 0xf987a7253ac413176f2b074cf7815e54),
+    (0x400, 0xf3392b0822b70005940c7a398e4b70f3),
+    (0x800, 0xe7159475a2c29b7443b29c7fa6e889d9),
+    (0x1000, 0xd097f3bdfd2022b8845ad8f792aa5825),
+    (0x2000, 0xa9f746462d870fdf8a65dc1f90e061e5),
+    (0x4000, 0x70d869a156d2a1b890bb3df62baf32f7),
+    (0x8000, 0x31be135f97d08fd981231505542fcfa6),
+    (0x10000, 0x9aa508b5b7a84e1c677de54f3e99bc9),
+    (0x20000, 0x5d6af8dedb81196699c329225ee604),
+    (0x40000, 0x2216e584f5fa1ea926041bedfe98),
+    (0x80000, 0x48a170391f7dc42444e8fa2),
+]
+
+
+def get_sqrt_ratio_at_tick(tick):
+    abs_tick = abs(tick)
+    if abs_tick > MAX_TICK:
+        raise ValueError(f"tick {tick} out of range")
+    ratio = 0xfffcb933bd6fad37aa2d162d1a594001 if abs_tick & 0x1 else 1 << 128
+    for bit, multiplier in _TICK_MULTIPLIERS:
+        if abs_tick & bit:
+            ratio = (ratio * multiplier) >> 128
+    if tick > 0:
+        ratio = (Q256 - 1) // ratio
+    # Q128.128 -> Q64.96, rounding up
+    return (ratio >> 32) + (0 if ratio % (1 << 32) == 0 else 1)
+
+
+def get_amount0_for_liquidity(sqrt_a, sqrt_b, liquidity):
+    if sqrt_a > sqrt_b:
+        sqrt_a, sqrt_b = sqrt_b, sqrt_a
+    return ((liquidity << 96) * (sqrt_b - sqrt_a) // sqrt_b) // sqrt_a
+
+
+def get_amount1_for_liquidity(sqrt_a, sqrt_b, liquidity):
+    if sqrt_a > sqrt_b:
+        sqrt_a, sqrt_b = sqrt_b, sqrt_a
+    return liquidity * (sqrt_b - sqrt_a) // Q96
+
+
+def get_amounts_for_liquidity(sqrt_price, sqrt_a, sqrt_b, liquidity):
+    if sqrt_a > sqrt_b:
+        sqrt_a, sqrt_b = sqrt_b, sqrt_a
+    if sqrt_price <= sqrt_a:
+        return get_amount0_for_liquidity(sqrt_a, sqrt_b, liquidity), 0
+    if sqrt_price < sqrt_b:
+        return get_amount0_for_liquidity(sqrt_price, sqrt_b, liquidity), get_amount1_for_liquidity(sqrt_a, sqrt_price, liquidity)
+    return 0, get_amount1_for_liquidity(sqrt_a, sqrt_b, liquidity)
+
+
+def position_amounts_exact(liquidity, tick_lower, tick_upper, sqrt_price_x96):
+    # Raw token amounts (smallest units), exactly as the pool would compute them
+    return get_amounts_for_liquidity(sqrt_price_x96, get_sqrt_ratio_at_tick(tick_lower), get_sqrt_ratio_at_tick(tick_upper), liquidity)
+
+
+def position_amounts(liquidity, tick_lower, tick_upper, sqrt_price_x96, decimals0, decimals1):
+    """Token amounts for many positions at once, scaled by each token's decimals.
+
+    All arguments are equal-length sequences; returns two float64 arrays (amount0, amount1).
+    """
+    liquidity = np.asarray([float(x) for x in liquidity], dtype=np.float64)
+    sqrt_lower = np.exp(np.asarray(tick_lower, dtype=np.float64) * _HALF_LOG_TICK_BASE)
+    sqrt_upper = np.exp(np.asarray(tick_upper, dtype=np.float64) * _HALF_LOG_TICK_BASE)
+    sqrt_price = np.asarray([float(x) for x in sqrt_price_x96], dtype=np.float64) / Q96
+
+    # Clamping the price into the range covers the below / in / above range cases in one expression
+    sqrt_clamped = np.clip(sqrt_price, sqrt_lower, sqrt_upper)
+    amount0 = liquidity * (sqrt_upper - sqrt_clamped) / (sqrt_clamped * sqrt_upper)
+    amount1 = liquidity * (sqrt_clamped - sqrt_lower)
+
+    amount0 /= np.power(10.0, np.asarray(decimals0, dtype=np.float64))
+    amount1 /= np.power(10.0, np.asarray(decimals1, dtype=np.float64))
+    return amount0, amount1
+
+
+def fee_growth_inside(tick_current, tick_lower, tick_upper, fee_growth_global, outside_lower, outside_upper):
+    # Pool.getFeeGrowthInside; all growth values wrap modulo 2**256 like the contract's unchecked math
+    below = outside_lower if tick_current >= tick_lower else fee_growth_global - outside_lower
+    above = outside_upper if tick_current < tick_upper else fee_growth_global - outside_upper
+    return (fee_growth_global - below - above) % Q256
+
+
+def uncollected_fees(liquidity, fee_growth_inside_now, fee_growth_inside_last, tokens_owed):
+    # Already-credited tokensOwed plus fees accrued since the position was last touched (raw units)
+    return tokens_owed + liquidity * ((fee_growth_inside_now - fee_growth_inside_last) % Q256) // Q128
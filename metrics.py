@@ -0,0 +1,235 @@
+# === metrics.py ===
+
+import os
+import re
+import time
+import random
+import asyncio
+import contextvars
+from contextlib import contextmanager
+import httpx
+
+# prometheus_client is optional: without it every metric below is a no-op and /metrics reports that it is disabled
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+except ImportError:
+    prometheus_client = None
+
+# Fraction of requests traced without asking; a request can always ask with an "X-Trace: 1" header
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_HEADER = "x-trace"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CYCLE_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+
+class _Noop:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, value=1):
+        pass
+
+    def dec(self, value=1):
+        pass
+
+
+def _metric(cls, name, doc, labels, **kwargs):
+    return cls(name, doc, labels, **kwargs) if prometheus_client is not None else _Noop()
+
+
+# upstream: explorer / geckoterminal / rpc / postgres; operation: HTTP method, JSON-RPC method or SQL verb + table
+UPSTREAM_SECONDS = _metric(Histogram, "upstream_request_seconds", "Latency of calls to upstream services", ["upstream", "operation"], buckets=LATENCY_BUCKETS)
+UPSTREAM_ERRORS = _metric(Counter, "upstream_errors_total", "Failed upstream calls", ["upstream", "operation", "kind"])
+UPSTREAM_RATE_LIMITED = _metric(Counter, "upstream_rate_limited_total", "429 responses from upstream services", ["upstream"])
+UPSTREAM_IN_FLIGHT = _metric(Gauge, "upstream_in_flight", "Upstream calls currently in progress", ["upstream"])
+REQUEST_SECONDS = _metric(Histogram, "http_request_seconds", "Total time per endpoint", ["endpoint"], buckets=LATENCY_BUCKETS)
+PHASE_SECONDS = _metric(Histogram, "request_phase_seconds", "Time per phase of an endpoint", ["endpoint", "phase"], buckets=LATENCY_BUCKETS)
+JOB_CYCLE_SECONDS = _metric(Histogram, "job_cycle_seconds", "Duration of each background job cycle", ["job"], buckets=CYCLE_BUCKETS)
+
+
+class Trace:
+    """Timing state of one request: the endpoint label and, when traced, every span recorded under it."""
+
+    __slots__ = ("endpoint", "started", "spans")
+
+    def __init__(self, endpoint, traced):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.spans = [] if traced else None
+
+    def add(self, kind, name, started, ended):
+        if self.spans is not None:
+            self.spans.append((kind, name, started - self.started, ended - started))
+
+    def server_timing(self):
+        # Phases summed per name, for the Server-Timing header
+        totals = {}
+        for kind, name, _, duration in self.spans or ():
+            if kind == "phase":
+                totals[name] = totals.get(name, 0.0) + duration
+        entries = [f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}"]
+        entries += [f"{re.sub(r'[^A-Za-z0-9_-]', '-', name)};dur={duration * 1000:.1f}" for name, duration in totals.items()]
+        return ", ".join(entries)
+
+    def report(self):
+        # Spans in start order; fetches that could overlap but start only after another ends ran serially
+        lines = [f"[TRACE] {self.endpoint} {(time.perf_counter() - self.started) * 1000:.1f}ms"]
+        for kind, name, offset, duration in sorted(self.spans or (), key=lambda s: s[2]):
+            lines.append(f"  +{offset * 1000:8.1f}ms {duration * 1000:8.1f}ms  {kind:<13} {name}")
+        return "\n".join(lines)
+
+
+_trace = contextvars.ContextVar("request_trace", default=None)
+
+
+def start_request(endpoint, traced=False):
+    trace = Trace(endpoint, traced or (TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE))
+    _trace.set(trace)
+    return trace
+
+
+def finish_request(trace):
+    REQUEST_SECONDS.labels(trace.endpoint).observe(time.perf_counter() - trace.started)
+
+
+@contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ended = time.perf_counter()
+        trace = _trace.get()
+        if trace is not None:
+            PHASE_SECONDS.labels(trace.endpoint, name).observe(ended - started)
+            trace.add("phase", name, started, ended)
+
+
+async def timed(name, aw):
+    with phase(name):
+        return await aw
+
+
+def _error_kind(exc):
+    if isinstance(exc, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return "timeout"
+    return type(exc).__name__
+
+
+@contextmanager
+def upstream_call(upstream, operation):
+    UPSTREAM_IN_FLIGHT.labels(upstream).inc()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        UPSTREAM_ERRORS.labels(upstream, operation, _error_kind(e)).inc()
+        raise
+    finally:
+        ended = time.perf_counter()
+        UPSTREAM_IN_FLIGHT.labels(upstream).dec()
+        UPSTREAM_SECONDS.labels(upstream, operation).observe(ended - started)
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(upstream, operation, started, ended)
+
+
+def upstream_status(upstream, operation, status_code):
+    if status_code == 429:
+        UPSTREAM_RATE_LIMITED.labels(upstream).inc()
+    elif status_code >= 500:
+        UPSTREAM_ERRORS.labels(upstream, operation, f"http_{status_code}").inc()
+
+
+
+async def rpc_middleware(make_request, w3):
+    # AsyncWeb3 middleware: every JSON-RPC call (Multicall batches arrive as eth_call) is timed by method
+    async def middleware(method, params):
+        with upstream_call("rpc", method):
+            try:
+                response = await make_request(method, params)
+            except Exception as e:
+                if getattr(e, "status", None) == 429:
+                    UPSTREAM_RATE_LIMITED.labels("rpc").inc()
+                raise
+        if isinstance(response, dict) and "error" in response:
+            UPSTREAM_ERRORS.labels("rpc", method, "rpc_error").inc()
+        return response
+
+    return middleware
+
+
+_SQL_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+([a-z_][a-z0-9_]*)", re.IGNORECASE)
+
+
+def _query_label(query):
+    words = query.split(None, 1)
+    if not words:
+        return "empty"
+    table = _SQL_TABLE.search(query)
+    return f"{words[0].upper()} {table.group(1)}" if table else words[0].upper()
+
+
+def observe_query(record):
+    # asyncpg query logger: called after each statement with its elapsed time
+    operation = _query_label(record.query)
+    UPSTREAM_SECONDS.labels("postgres", operation).observe(record.elapsed)
+    if record.exception is not None:
+        UPSTREAM_ERRORS.labels("postgres", operation, _error_kind(record.exception)).inc()
+    trace = _trace.get()
+    if trace is not None:
+        ended = time.perf_counter()
+        trace.add("postgres", operation, ended - record.elapsed, ended)
+
+
+_cache_sources = {}
+_pool_source = None
+
+
+def register_cache(name, stats):
+    # stats(): dict with "hits" and "misses" (and optionally "entries"), read at scrape time
+    _cache_sources[name] = stats
+
+
+def register_pool(get_pool):
+    global _pool_source
+    _pool_source = get_pool
+
+
+class _StatsCollector:
+    def collect(self):
+        hits = CounterMetricFamily("cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("cache_misses", "Cache misses", labels=["cache"])
+        ratio = GaugeMetricFamily("cache_hit_ratio", "Cache hits / lookups since start", labels=["cache"])
+        entries = GaugeMetricFamily("cache_entries", "Entries currently cached", labels=["cache"])
+        for name, stats in _cache_sources.items():
+            s = stats()
+            hits.add_metric([name], s["hits"])
+            misses.add_metric([name], s["misses"])
+            lookups = s["hits"] + s["misses"]
+            ratio.add_metric([name], s["hits"] / lookups if lookups else 0.0)
+            if "entries" in s:
+                entries.add_metric([name], s["entries"])
+        yield from (hits, misses, ratio, entries)
+
+        pool = _pool_source() if _pool_source else None
+        if pool is not None:
+            yield GaugeMetricFamily("db_pool_connections", "Connections open in the Postgres pool", value=pool.get_size())
+            yield GaugeMetricFamily("db_pool_idle_connections", "Idle connections in the Postgres pool", value=pool.get_idle_size())
+
+
+if prometheus_client is not None:
+    prometheus_client.REGISTRY.register(_StatsCollector())
+
+
+def render():
+    # (body, content type) for the /metrics endpoint
+    if prometheus_client is None:
+        return b"# prometheus_client is not installed; metrics are disabled\n", "text/plain; charset=utf-8"
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
@@ -0,0 +1,206 @@
+# === multicall.py ===
+
+import os
+import asyncio
+from collections import namedtuple
+from web3 import Web3
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+import upstream
+from singleflight import detached_task
+
+# Canonical Multicall3 deployment (same address on every EVM chain it is deployed to)
+MULTICALL3_ADDRESS = Web3.to_checksum_address(os.getenv("MULTICALL3_ADDRESS", "0xcA11bde05977b3631167028862bE2a173976CA11"))
+
+multicall3_abi = [{
+    "name": "aggregate3",
+    "type": "function",
+    "stateMutability": "payable",
+    "inputs": [{
+        "name": "calls",
+        "type": "tuple[]",
+        "components": [
+            {"name": "target", "type": "address"},
+            {"name": "allowFailure", "type": "bool"},
+            {"name": "callData", "type": "bytes"},
+        ]
+    }],
+    "outputs": [{
+        "name": "returnData",
+        "type": "tuple[]",
+        "components": [
+            {"name": "success", "type": "bool"},
+            {"name": "returnData", "type": "bytes"},
+        ]
+    }]
+}]
+
+# A call against a bare address, e.g. slot0 on a pool we have no ABI for. The result value is the raw return bytes.
+RawCall = namedtuple("RawCall", ["address", "data"])
+
+# Per-call outcome: value is the decoded output (same shape as ContractFunction.call()), error the failure reason
+CallResult = namedtuple("CallResult", ["success", "value", "error"])
+
+_multicall3_available = {}
+
+
+def _encode(call):
+    if isinstance(call, RawCall):
+        data = call.data if isinstance(call.data, (bytes, bytearray)) else bytes.fromhex(call.data.removeprefix("0x"))
+        return Web3.to_checksum_address(call.address), bytes(data)
+    return Web3.to_checksum_address(call.address), bytes.fromhex(call._encode_transaction_data()[2:])
+
+
+def _decode(w3, call, data):
+    if isinstance(call, RawCall):
+        return bytes(data)
+    output_types = get_abi_output_types(call.abi)
+    decoded = w3.codec.decode(output_types, bytes(data))
+    normalized = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, decoded)
+    return normalized[0] if len(normalized) == 1 else list(normalized)
+
+
+def _block_param(block_identifier):
+    return hex(block_identifier) if isinstance(block_identifier, int) else block_identifier
+
+
+async def _has_multicall3(w3):
+    endpoint = w3.provider.endpoint_uri
+    if endpoint not in _multicall3_available:
+        try:
+            _multicall3_available[endpoint] = len(await w3.eth.get_code(MULTICALL3_ADDRESS)) > 0
+        except Exception as e:
+            print(f"[MULTICALL] Could not probe Multicall3: {repr(e)}")
+            return False
+        if not _multicall3_available[endpoint]:
+            print("[MULTICALL] Multicall3 not deployed, using JSON-RPC batches")
+    return _multicall3_available[endpoint]
+
+
+async def _aggregate3(w3, encoded, block_identifier):
+    multicall = w3.eth.contract(address=MULTICALL3_ADDRESS, abi=multicall3_abi)
+    results = await multicall.functions.aggregate3([(target, True, data) for target, data in encoded]).call(block_identifier=block_identifier)
+    return [(success, data if success else ValueError(f"execution reverted: 0x{bytes(data).hex()}")) for success, data in results]
+
+
+async def _rpc_batch(w3, encoded, block_identifier):
+    payload = [
+        {
+            "jsonrpc": "2.0",
+            "id": i,
+            "method": "eth_call",
+            "params": [{"to": target, "data": "0x" + data.hex()}, _block_param(block_identifier)]
+        }
+        for i, (target, data) in enumerate(encoded)
+    ]
+    responses = {r.get("id"): r for r in await upstream.post_json(w3.provider.endpoint_uri, payload)}
+
+    results = []
+    for i in range(len(encoded)):
+        r = responses.get(i)
+        if r is None:
+            results.append((False, ValueError("missing response in JSON-RPC batch")))
+        elif "error" in r:
+            results.append((False, ValueError(r["error"].get("message", str(r["error"])))))
+        else:
+            results.append((True, bytes.fromhex(r["result"][2:])))
+    return results
+
+
+def reverted(result):
+    # The call itself reverted on-chain (as opposed to a failed round trip, a missing response or bad output)
+    return not result.success and isinstance(result.error, ValueError) and str(result.error).startswith("execution reverted")
+
+
+async def batch_call(w3, calls, block_identifier="latest"):
+    """Run view calls in one round trip (Multicall3 aggregate3, or a JSON-RPC batch as fallback).
+
+    `calls` is a list of bound ContractFunctions (e.g. `contract.functions.getRewards(wallet)`) or RawCalls.
+    Returns one CallResult per call, in order; a failing call never fails the others.
+    """
+    if not calls:
+        return []
+
+    encoded = [_encode(c) for c in calls]
+    raw = None
+    if await _has_multicall3(w3):
+        try:
+            raw = await _aggregate3(w3, encoded, block_identifier)
+        except Exception as e:
+            print(f"[MULTICALL] aggregate3 failed, falling back to JSON-RPC batch: {repr(e)}")
+    if raw is None:
+        try:
+            raw = await _rpc_batch(w3, encoded, block_identifier)
+        except Exception as e:
+            return [CallResult(False, None, e) for _ in calls]
+
+    results = []
+    for call, (success, data) in zip(calls, raw):
+        if not success:
+            results.append(CallResult(False, None, data))
+            continue
+        try:
+            results.append(CallResult(True, _decode(w3, call, data), None))
+        except Exception as e:
+            results.append(CallResult(False, None, e))
+    return results
+
+
+class CallCoalescer:
+    """Merges batch_call()s from concurrent callers into one round trip per block.
+
+    Calls queued within `window` seconds for the same block go out together, up to `max_calls` per round trip.
+    """
+
+    def __init__(self, w3, window=0.01, max_calls=300):
+        self.w3 = w3
+        self.window = window
+        self.max_calls = max_calls
+        self._pending = {}
+        self._flush_handles = {}
+        self.round_trips = 0
+        self.calls = 0
+
+    async def call(self, calls, block_identifier="latest"):
+        if not calls:
+            return []
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        queue = self._pending.setdefault(block_identifier, [])
+        queue.append((list(calls), fut))
+        if sum(len(c) for c, _ in queue) >= self.max_calls:
+            self._flush(block_identifier)
+        elif block_identifier not in self._flush_handles:
+            self._flush_handles[block_identifier] = loop.call_later(self.window, self._flush, block_identifier)
+        # Shielded so one caller giving up does not fail the round trip for the others
+        return await asyncio.shield(fut)
+
+    def _flush(self, block_identifier):
+        handle = self._flush_handles.pop(block_identifier, None)
+        if handle is not None:
+            handle.cancel()
+        queue = self._pending.pop(block_identifier, [])
+        if queue:
+            detached_task(self._run(queue, block_identifier))
+
+    async def _run(self, queue, block_identifier):
+        merged = [call for calls, _ in queue for call in calls]
+        # A single large call list, or queued lists adding up past max_calls, go out as concurrent round trips
+        chunks = [merged[i:i + self.max_calls] for i in range(0, len(merged), self.max_calls)]
+        self.round_trips += len(chunks)
+        self.calls += len(merged)
+        outcomes = await asyncio.gather(*(batch_call(self.w3, chunk, block_identifier) for chunk in chunks), return_exceptions=True)
+        results = []
+        for chunk, outcome in zip(chunks, outcomes):
+            if isinstance(outcome, BaseException):
+                results += [CallResult(False, None, outcome) for _ in chunk]
+            else:
+                results += outcome
+        offset = 0
+        for calls, fut in queue:
+            if not fut.done():
+                fut.set_result(results[offset:offset + len(calls)])
+            offset += len(calls)
+
+    def stats(self):
+        return {"round_trips": self.round_trips, "calls": self.calls}
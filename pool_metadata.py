@@ -0,0 +1,101 @@
+# === pool_metadata.py ===
+
+import re
+import time
+from collections import namedtuple
+import db
+
+# Immutable per-pool facts (tokens, symbols, decimals, fee tier), indexed by pool address and by LP token ID.
+# Filled the first time a position is seen, so later requests skip parsing the NFT description.
+PoolMetadata = namedtuple("PoolMetadata", ["pool_address", "token0", "token1", "symbol0", "symbol1", "decimals0", "decimals1", "fee"])
+
+# "<Label> Address: 0x..." lines of the position NFT description; the "Pool" label is the pool itself
+_ADDRESS_LINE = re.compile(r"(\S+) Address: (0x[a-fA-F0-9]{40})")
+
+_pools = {}
+_positions = {}
+
+
+def parse_description(description):
+    # One pass over the description: (pool address, {token address: symbol})
+    pool_address = None
+    symbols = {}
+    for label, address in _ADDRESS_LINE.findall(description):
+        if label == "Pool" and pool_address is None:
+            pool_address = address.lower()
+        else:
+            symbols.setdefault(address.lower(), label)
+    return pool_address, symbols
+
+
+def for_position(token_id):
+    pool_address = _positions.get(token_id)
+    return _pools.get(pool_address) if pool_address else None
+
+
+def get(pool_address):
+    return _pools.get(pool_address)
+
+
+def complete(meta):
+    return meta.decimals0 is not None and meta.decimals1 is not None
+
+
+async def load():
+    if db.pool is None:
+        return 0
+    started = time.perf_counter()
+    async with db.pool.acquire() as conn:
+        pools = await conn.fetch("SELECT pool_address, token0, token1, symbol0, symbol1, decimals0, decimals1, fee FROM lp_pools")
+        positions = await conn.fetch("SELECT token_id, pool_address FROM lp_position_pools")
+    for row in pools:
+        _pools[row["pool_address"]] = PoolMetadata(*row.values())
+    for row in positions:
+        _positions[row["token_id"]] = row["pool_address"]
+    print(f"[POOL METADATA] Loaded {len(pools)} pools, {len(positions)} positions in {time.perf_counter() - started:.2f}s")
+    return len(pools)
+
+
+async def load_positions(token_ids):
+    # Positions another worker indexed after this one started; returns the IDs still unknown
+    missing = [token_id for token_id in token_ids if token_id not in _positions]
+    if not missing or db.pool is None:
+        return missing
+    rows = await db.pool.fetch("""
+        SELECT p.token_id, l.pool_address, l.token0, l.token1, l.symbol0, l.symbol1, l.decimals0, l.decimals1, l.fee
+        FROM lp_position_pools p
+        JOIN lp_pools l ON l.pool_address = p.pool_address
+        WHERE p.token_id = ANY($1::bigint[])
+    """, missing)
+    for row in rows:
+        values = list(row.values())
+        _pools.setdefault(row["pool_address"], PoolMetadata(*values[1:]))
+        _positions[row["token_id"]] = row["pool_address"]
+    return [token_id for token_id in missing if token_id not in _positions]
+
+
+async def save(pools, positions):
+    # pools: {pool_address: PoolMetadata}, positions: {token_id: pool_address}
+    _pools.update(pools)
+    _positions.update(positions)
+    if db.pool is None or not (pools or positions):
+        return
+    try:
+        async with db.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany("""
+                    INSERT INTO lp_pools (pool_address, token0, token1, symbol0, symbol1, decimals0, decimals1, fee)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+                    ON CONFLICT (pool_address) DO UPDATE SET
+                        symbol0 = COALESCE(EXCLUDED.symbol0, lp_pools.symbol0),
+                        symbol1 = COALESCE(EXCLUDED.symbol1, lp_pools.symbol1),
+                        decimals0 = COALESCE(EXCLUDED.decimals0, lp_pools.decimals0),
+                        decimals1 = COALESCE(EXCLUDED.decimals1, lp_pools.decimals1)
+                """, [tuple(meta) for meta in pools.values()])
+                await conn.executemany("""
+                    INSERT INTO lp_position_pools (token_id, pool_address)
+                    VALUES ($1, $2)
+                    ON CONFLICT (token_id) DO NOTHING
+                """, list(positions.items()))
+    except Exception as e:
+        print(f"[POOL METADATA] Failed to persist {len(pools)} pools: {repr(e)}")
@@ -0,0 +1,36 @@
+# === prewarm.py ===
+
+import os
+import time
+import asyncio
+import valuation
+
+# Keeps prices fresh for tokens that tracked wallets (valued every history cycle) and recently
+# queried wallets hold, so request handlers can answer from the cache without waiting on GeckoTerminal
+PREWARM_INTERVAL = int(os.getenv("PREWARM_INTERVAL", "60"))
+# How long a token stays "hot" after a wallet holding it was valued; longer than the hourly history cycle
+PREWARM_WINDOW = int(os.getenv("PREWARM_WINDOW", str(2 * 60 * 60)))
+
+
+async def prewarm_once():
+    now = time.time()
+    # Refresh anything that would go stale before the next tick
+    price_before = now - valuation.CACHE_TTL + PREWARM_INTERVAL
+    tokens = valuation.token_cache.prewarm_candidates(now - PREWARM_WINDOW, price_before)
+
+    await valuation.refresh_pepu_price(now, max_age=valuation.CACHE_TTL - PREWARM_INTERVAL)
+    if tokens:
+        await valuation.populate_price_cache(tokens, now)
+    return len(tokens)
+
+
+async def prewarm_loop():
+    while True:
+        try:
+            started = time.perf_counter()
+            refreshed = await prewarm_once()
+            if refreshed:
+                print(f"[PREWARM] Refreshed {refreshed} token prices in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            print(f"[PREWARM ERROR] {repr(e)}")
+        await asyncio.sleep(PREWARM_INTERVAL)
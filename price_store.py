@@ -0,0 +1,79 @@
+# === price_store.py ===
+
+import os
+import time
+import asyncio
+import db
+
+# Periodic snapshots of token_cache / pepu_cache prices so a restart does not start cold
+PRICE_SNAPSHOT_INTERVAL = int(os.getenv("PRICE_SNAPSHOT_INTERVAL", "120"))
+# Entries older than this are not worth restoring
+PRICE_RESTORE_MAX_AGE = int(os.getenv("PRICE_RESTORE_MAX_AGE", str(24 * 60 * 60)))
+
+PEPU_KEY = "pepu"
+
+_last_snapshot = 0.0
+
+
+async def load(token_cache, pepu_cache):
+    global _last_snapshot
+    if db.pool is None:
+        return 0
+    started = time.perf_counter()
+    rows = await db.pool.fetch("""
+        SELECT address, price_usd, liquidity, volume_24h_usd, price_change_24h_percentage, icon_url, price_ts
+        FROM price_cache
+        WHERE price_ts > $1
+    """, time.time() - PRICE_RESTORE_MAX_AGE)
+
+    token_rows = []
+    for r in rows:
+        if r["address"] == PEPU_KEY:
+            if r["price_ts"] > pepu_cache["timestamp"]:
+                pepu_cache["price"] = r["price_usd"]
+                pepu_cache["icon"] = r["icon_url"]
+                pepu_cache["timestamp"] = r["price_ts"]
+        else:
+            token_rows.append((r["address"], r["price_usd"], r["liquidity"], r["volume_24h_usd"], r["price_change_24h_percentage"], r["price_ts"]))
+    token_cache.restore_prices(token_rows)
+    # Everything restored is already in the table
+    _last_snapshot = max((r["price_ts"] for r in rows), default=0.0)
+
+    print(f"[PRICE CACHE] Restored {len(rows)} entries in {(time.perf_counter() - started) * 1000:.0f}ms")
+    return len(rows)
+
+
+async def save(token_cache, pepu_cache):
+    # Upserts only entries priced since the previous snapshot
+    global _last_snapshot
+    if db.pool is None:
+        return 0
+    since = _last_snapshot
+    taken_at = time.time()
+    records = [(addr, price, liq, vol, change, None, ts) for addr, price, liq, vol, change, ts in token_cache.snapshot_prices(since)]
+    if pepu_cache["price"] is not None and pepu_cache["timestamp"] > since:
+        records.append((PEPU_KEY, pepu_cache["price"], None, None, None, pepu_cache["icon"], pepu_cache["timestamp"]))
+    if records:
+        await db.pool.executemany("""
+            INSERT INTO price_cache (address, price_usd, liquidity, volume_24h_usd, price_change_24h_percentage, icon_url, price_ts)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            ON CONFLICT (address) DO UPDATE SET
+                price_usd = EXCLUDED.price_usd,
+                liquidity = EXCLUDED.liquidity,
+                volume_24h_usd = EXCLUDED.volume_24h_usd,
+                price_change_24h_percentage = EXCLUDED.price_change_24h_percentage,
+                icon_url = EXCLUDED.icon_url,
+                price_ts = EXCLUDED.price_ts
+            WHERE EXCLUDED.price_ts > price_cache.price_ts
+        """, records)
+    _last_snapshot = taken_at
+    return len(records)
+
+
+async def snapshot_loop(token_cache, pepu_cache):
+    while True:
+        await asyncio.sleep(PRICE_SNAPSHOT_INTERVAL)
+        try:
+            await save(token_cache, pepu_cache)
+        except Exception as e:
+            print(f"[PRICE CACHE ERROR] Snapshot failed: {repr(e)}")
@@ -0,0 +1,116 @@
+# === ratelimit.py ===
+
+import os
+import time
+import asyncio
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+# GeckoTerminal's public API allows 30 calls per minute
+GECKO_RATE_PER_MIN = float(os.getenv("GECKO_RATE_PER_MIN", "30"))
+GECKO_BURST = int(os.getenv("GECKO_BURST", "5"))
+# Hosts without a published limit still get a bucket so 429 / Retry-After is honoured everywhere
+DEFAULT_RATE_PER_SEC = float(os.getenv("DEFAULT_RATE_PER_SEC", "20"))
+DEFAULT_BURST = int(os.getenv("DEFAULT_BURST", "40"))
+# Fallback pause after a 429 without a usable Retry-After header
+DEFAULT_RETRY_AFTER = float(os.getenv("DEFAULT_RETRY_AFTER", "10"))
+
+# Keyed by host[:port]; upstream registers GeckoTerminal's limit for whichever base URL is configured
+HOST_LIMITS = {}
+
+
+class TokenBucket:
+    """FIFO async token bucket. Waiters queue on an asyncio.Lock, so nothing blocks the event loop."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self.queued = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.throttled = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        started = time.monotonic()
+        self.queued += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now < self.paused_until:
+                        await asyncio.sleep(self.paused_until - now)
+                    elif self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    else:
+                        await asyncio.sleep((1 - self.tokens) / self.rate)
+        finally:
+            self.queued -= 1
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def pause(self, seconds):
+        # Upstream said slow down: hold the whole queue, and drop the burst allowance
+        self.throttled += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    def stats(self):
+        return {
+            "rate_per_sec": self.rate,
+            "burst": self.capacity,
+            "queue_depth": self.queued,
+            "acquired": self.acquired,
+            "avg_wait_s": round(self.total_wait / self.acquired, 4) if self.acquired else 0.0,
+            "max_wait_s": round(self.max_wait, 4),
+            "throttled": self.throttled,
+            "paused_for_s": round(max(0.0, self.paused_until - time.monotonic()), 2),
+        }
+
+
+_buckets = {}
+
+
+def set_host_limit(url, rate, burst):
+    HOST_LIMITS[urlsplit(url).netloc] = (rate, burst)
+
+
+def bucket_for(url):
+    # Port included, so local stand-ins sharing one host still get a bucket each
+    host = urlsplit(url).netloc
+    bucket = _buckets.get(host)
+    if bucket is None:
+        rate, burst = HOST_LIMITS.get(host, (DEFAULT_RATE_PER_SEC, DEFAULT_BURST))
+        bucket = _buckets[host] = TokenBucket(rate, burst)
+    return bucket
+
+
+def retry_after_seconds(value):
+    # Retry-After is either delta-seconds or an HTTP date
+    if not value:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return DEFAULT_RETRY_AFTER
+
+
+def stats():
+    return {host: bucket.stats() for host, bucket in _buckets.items()}
@@ -0,0 +1,76 @@
+# === response_cache.py ===
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+# Clients may reuse a response this long before revalidating with If-None-Match
+RESPONSE_MAX_AGE = int(os.getenv("RESPONSE_MAX_AGE", "2"))
+# Prices are not part of the key, so an entry is also dropped after this long in case the block stops advancing
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "30"))
+
+
+def make_etag(body):
+    # Hash of the response body itself; key order is normalised so equal bodies always share a tag
+    encoded = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return 'W/"' + hashlib.blake2b(encoded, digest_size=12).hexdigest() + '"'
+
+
+def cache_headers(etag):
+    return {"ETag": etag, "Cache-Control": f"private, max-age={RESPONSE_MAX_AGE}, must-revalidate"}
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as required for If-None-Match
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return etag.removeprefix("W/") in tags
+
+
+class ResponseCache:
+    """Bounded LRU of (response body, ETag) keyed by (endpoint, wallet, block)."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+            }
@@ -0,0 +1,68 @@
+# === response_encoding.py ===
+
+import gzip
+import json
+from fastapi import Response
+
+# Optional speedups / formats; everything falls back to the standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+MEDIA_TYPES = {"json": "application/json", "msgpack": "application/msgpack"}
+
+
+def available_formats():
+    return ("json", "msgpack") if msgpack is not None else ("json",)
+
+
+def serialize(body, fmt="json"):
+    if fmt == "msgpack":
+        return msgpack.packb(body, use_bin_type=True)
+    if orjson is not None:
+        return orjson.dumps(body)
+    return json.dumps(body, separators=(",", ":")).encode()
+
+
+def negotiate(accept_encoding):
+    # Highest-q coding we support; brotli wins ties since it is smaller at similar CPU
+    offered = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[coding.strip().lower()] = q
+    candidates = [c for c in (("br",) if brotli is not None else ()) + ("gzip",) if offered.get(c, offered.get("*", 0)) > 0]
+    return max(candidates, key=lambda c: offered.get(c, offered.get("*", 0)), default=None)
+
+
+def encoded_response(body, fmt="json", accept_encoding=None, headers=None):
+    content = serialize(body, fmt)
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    coding = negotiate(accept_encoding) if len(content) >= COMPRESS_MIN_BYTES else None
+    if coding == "br":
+        content = brotli.compress(content, quality=BROTLI_QUALITY)
+    elif coding == "gzip":
+        content = gzip.compress(content, compresslevel=GZIP_LEVEL)
+    if coding:
+        headers["Content-Encoding"] = coding
+    return Response(content=content, media_type=MEDIA_TYPES[fmt], headers=headers)
@@ -0,0 +1,100 @@
+# === singleflight.py ===
+
+import asyncio
+import contextvars
+import deadline
+
+
+def detached_task(coro):
+    # Shared work runs in a copy of the caller's context with the request deadline cleared: it is not bound by
+    # the first caller's budget, but its upstream calls still show up in that caller's trace
+    context = contextvars.copy_context()
+    context.run(deadline.clear)
+    return context.run(asyncio.ensure_future, coro)
+
+
+class SingleFlight:
+    """At most one in-flight call per key; concurrent callers await the same result.
+
+    With `detach=False` the call keeps the first caller's context (and so its deadline).
+    """
+
+    def __init__(self, detach=True):
+        self.detach = detach
+        self._calls = {}
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = detached_task(fn()) if self.detach else asyncio.ensure_future(fn())
+            self._calls[key] = task
+
+            def forget(done, key=key):
+                if self._calls.get(key) is done:
+                    del self._calls[key]
+
+            task.add_done_callback(forget)
+        # Shielded so one caller giving up does not cancel the fetch for everyone else
+        return await asyncio.shield(task)
+
+    def in_flight(self):
+        return len(self._calls)
+
+
+class BatchCoalescer:
+    """Merges keys requested by concurrent callers into shared batches.
+
+    Keys queued within `window` seconds go out together in chunks of `max_batch`. A key that is already
+    queued or in flight is never requested twice. `fetch_batch(keys)` returns the keys it loaded;
+    `load()` returns the keys that failed.
+    """
+
+    def __init__(self, fetch_batch, max_batch=30, window=0.05):
+        self.fetch_batch = fetch_batch
+        self.max_batch = max_batch
+        self.window = window
+        self._pending = {}
+        self._in_flight = {}
+        self._flush_handle = None
+
+    async def load(self, keys):
+        loop = asyncio.get_running_loop()
+        waiting = {}
+        for key in keys:
+            if key in waiting:
+                continue
+            fut = self._in_flight.get(key) or self._pending.get(key)
+            if fut is None:
+                fut = self._pending[key] = loop.create_future()
+                if len(self._pending) >= self.max_batch:
+                    self._flush()
+                elif self._flush_handle is None:
+                    self._flush_handle = loop.call_later(self.window, self._flush)
+            waiting[key] = fut
+
+        loaded = await asyncio.gather(*(asyncio.shield(f) for f in waiting.values()))
+        return [key for key, ok in zip(waiting, loaded) if not ok]
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        self._in_flight.update(pending)
+        keys = list(pending)
+        for i in range(0, len(keys), self.max_batch):
+            batch = {key: pending[key] for key in keys[i:i + self.max_batch]}
+            detached_task(self._run(batch))
+
+    async def _run(self, batch):
+        loaded = set()
+        try:
+            loaded = set(await self.fetch_batch(list(batch)) or ())
+        except Exception as e:
+            print(f"[BATCH] Fetch failed for {len(batch)} keys: {repr(e)}")
+        finally:
+            for key, fut in batch.items():
+                if self._in_flight.get(key) is fut:
+                    del self._in_flight[key]
+                if not fut.done():
+                    fut.set_result(key in loaded)
@@ -0,0 +1,71 @@
+# === streaming.py ===
+
+import json
+import asyncio
+import deadline
+import valuation
+
+STREAM_FORMATS = ("ndjson", "sse")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+_DONE = object()
+
+
+def encode(event, data, fmt):
+    body = json.dumps(data, default=str)
+    if fmt == "sse":
+        return f"event: {event}\ndata: {body}\n\n"
+    return json.dumps({"event": event, "data": data}, default=str) + "\n"
+
+
+# Every wallet section as its own event, in the order they finish, then one "totals" event
+async def stream_wallet(wallet, fmt="ndjson", deadline_ms=None):
+    queue = asyncio.Queue()
+
+    def emit(event, data):
+        queue.put_nowait((event, data))
+
+    async def section(name, coro, emit_result):
+        try:
+            res = await coro
+        except Exception as e:
+            res = {"error": str(e)}
+        if emit_result or "error" in res:
+            emit(name, res)
+        return res
+
+    with deadline.budget(deadline_ms or deadline.DEFAULT_DEADLINE_MS):
+        try:
+            block = await deadline.bounded(valuation.current_block())
+        except Exception:
+            block = "latest"
+
+        tasks = {
+            "portfolio": section("portfolio", valuation.get_portfolio(wallet, block_identifier=block, emit=emit), False),
+            "lp_positions": section("lp_positions", valuation.get_lp_positions(wallet, block_identifier=block, emit=emit), False),
+            "staking": section("staking", valuation.get_staking(wallet, block_identifier=block), True),
+            "presales": section("presales", valuation.get_presales(wallet, block_identifier=block), True),
+        }
+        gathered = asyncio.ensure_future(asyncio.gather(*tasks.values()))
+        gathered.add_done_callback(lambda _: queue.put_nowait(_DONE))
+
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    break
+                yield encode(*item, fmt)
+        finally:
+            # Client went away mid-stream
+            gathered.cancel()
+
+        results = dict(zip(tasks, gathered.result()))
+        totals = {name: round(res.get("total_value_usd", 0) or 0, 2) for name, res in results.items()}
+        pending = [p for res in results.values() for p in res.get("pending", [])]
+        yield encode("totals", {
+            "block": block,
+            "totals_usd": totals,
+            "total_value_usd": round(sum(totals.values()), 2),
+            "pending": pending,
+            "partial": bool(pending),
+        }, fmt)
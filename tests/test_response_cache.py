@@ -0,0 +1,62 @@
+# === tests/test_response_cache.py ===
+# Conditional polls of an unchanged wallet must be answered from the response cache with 304
+
+import os
+import sys
+import time
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import main
+import response_cache
+import valuation
+
+WALLET = "0x" + "ab" * 20
+
+
+def fake_wallet(monkeypatch, block=1_000_000):
+    state = {"block": block, "computed": 0}
+
+    async def current_block():
+        return state["block"]
+
+    async def get_portfolio(wallet, log_mode=False, block_identifier="latest", emit=None):
+        state["computed"] += 1
+        # Computing a response writes prices and icons, as the real one does
+        now = time.time()
+        valuation.token_cache.set_price("0x" + "cd" * 20, 1.5, 10_000, 100, 0.0, now)
+        valuation.token_cache.set_icon("0x" + "cd" * 20, "https://example.com/icon.png", now)
+        return {"wallet": wallet, "tokens": [{"symbol": "MCK", "price_usd": 1.5}], "total_value_usd": 1.5, "pending": []}
+
+    monkeypatch.setattr(valuation, "current_block", current_block)
+    monkeypatch.setattr(valuation, "get_portfolio", get_portfolio)
+    monkeypatch.setattr(main, "wallet_responses", response_cache.ResponseCache())
+    return state
+
+
+def test_repeat_poll_is_a_cache_hit_and_304(monkeypatch):
+    state = fake_wallet(monkeypatch)
+    client = TestClient(main.app)
+
+    first = client.get("/portfolio", params={"wallet": WALLET})
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    second = client.get("/portfolio", params={"wallet": WALLET}, headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.headers["etag"] == etag
+    assert state["computed"] == 1
+    stats = main.wallet_responses.stats()
+    assert stats["hits"] == 1
+    assert stats["not_modified"] == 1
+
+
+def test_unchanged_wallet_keeps_its_etag_across_blocks(monkeypatch):
+    state = fake_wallet(monkeypatch)
+    client = TestClient(main.app)
+
+    etag = client.get("/portfolio", params={"wallet": WALLET}).headers["etag"]
+    state["block"] += 1
+    res = client.get("/portfolio", params={"wallet": WALLET}, headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert state["computed"] == 2
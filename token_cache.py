@@ -0,0 +1,179 @@
+# === token_cache.py ===
+
+import threading
+from collections import OrderedDict
+
+
+class TokenEntry:
+    __slots__ = ("price_usd", "liquidity", "volume_24h_usd", "price_change_24h_percentage", "price_ts", "icon_url", "icon_expires", "seen_ts")
+
+    def __init__(self):
+        self.price_usd = None
+        self.liquidity = None
+        self.volume_24h_usd = None
+        self.price_change_24h_percentage = None
+        self.price_ts = None
+        self.icon_url = None
+        self.icon_expires = None
+        self.seen_ts = None
+
+    def as_dict(self):
+        info = {}
+        if self.price_ts is not None:
+            info["price_usd"] = self.price_usd
+            info["liquidity"] = self.liquidity
+            info["volume_24h_usd"] = self.volume_24h_usd
+            info["price_change_24h_percentage"] = self.price_change_24h_percentage
+            info["timestamp"] = self.price_ts
+        if self.icon_url is not None:
+            info["icon_url"] = self.icon_url
+        return info
+
+
+class TokenCache:
+    """Bounded LRU of per-token price and icon data, with separate TTLs for each."""
+
+    def __init__(self, max_entries=5000, price_ttl=300, icon_ttl=24 * 60 * 60):
+        self.max_entries = max_entries
+        self.price_ttl = price_ttl
+        self.icon_ttl = icon_ttl
+        self._entries = OrderedDict()
+        self._pinned = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _entry(self, addr):
+        # Caller holds the lock
+        entry = self._entries.get(addr)
+        if entry is None:
+            entry = self._entries[addr] = TokenEntry()
+            while len(self._entries) > self.max_entries:
+                for victim in self._entries:
+                    if victim not in self._pinned:
+                        del self._entries[victim]
+                        self.evictions += 1
+                        break
+                else:
+                    break
+        else:
+            self._entries.move_to_end(addr)
+        return entry
+
+    def pin_icon(self, addr, icon_url):
+        # Static icons that never expire and are never evicted
+        with self._lock:
+            entry = self._entry(addr)
+            entry.icon_url = icon_url
+            entry.icon_expires = float("inf")
+            self._pinned.add(addr)
+
+    def get(self, addr, now=None):
+        with self._lock:
+            entry = self._entries.get(addr)
+            if entry is None:
+                return {}
+            self._entries.move_to_end(addr)
+            if now is not None:
+                entry.seen_ts = now
+            return entry.as_dict()
+
+    def has_price(self, addr):
+        with self._lock:
+            entry = self._entries.get(addr)
+            return entry is not None and entry.price_ts is not None
+
+    def is_stale(self, info, now):
+        # `info` as returned by get()
+        return now - info.get("timestamp", 0) > self.price_ttl
+
+    def prewarm_candidates(self, seen_since, price_before):
+        # Tokens served to a wallet since `seen_since` whose price is older than `price_before`
+        with self._lock:
+            return [
+                addr for addr, entry in self._entries.items()
+                if entry.seen_ts is not None and entry.seen_ts >= seen_since
+                and (entry.price_ts is None or entry.price_ts < price_before)
+            ]
+
+    def stale_prices(self, addrs, now):
+        stale = []
+        with self._lock:
+            for addr in addrs:
+                entry = self._entries.get(addr)
+                if entry is None or entry.price_ts is None or now - entry.price_ts > self.price_ttl:
+                    self.misses += 1
+                    stale.append(addr)
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(addr)
+        return stale
+
+    def missing_icons(self, addrs, now):
+        missing = []
+        with self._lock:
+            for addr in addrs:
+                entry = self._entries.get(addr)
+                if entry is None or entry.icon_expires is None or now > entry.icon_expires:
+                    self.misses += 1
+                    missing.append(addr)
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(addr)
+        return missing
+
+    def set_price(self, addr, price_usd, liquidity, volume_24h_usd, price_change_24h_percentage, now):
+        with self._lock:
+            entry = self._entry(addr)
+            entry.price_usd = price_usd
+            entry.liquidity = liquidity
+            entry.volume_24h_usd = volume_24h_usd
+            entry.price_change_24h_percentage = price_change_24h_percentage
+            entry.price_ts = now
+
+    def snapshot_prices(self, since=0):
+        # (addr, price_usd, liquidity, volume_24h_usd, price_change_24h_percentage, price_ts) priced after `since`
+        with self._lock:
+            return [
+                (addr, e.price_usd, e.liquidity, e.volume_24h_usd, e.price_change_24h_percentage, e.price_ts)
+                for addr, e in self._entries.items()
+                if e.price_ts is not None and e.price_ts > since
+            ]
+
+    def restore_prices(self, rows):
+        # Inverse of snapshot_prices; keeps the original timestamps so the normal TTL applies
+        with self._lock:
+            for addr, price_usd, liquidity, volume_24h_usd, price_change_24h_percentage, price_ts in rows:
+                entry = self._entry(addr)
+                if entry.price_ts is not None and entry.price_ts >= price_ts:
+                    continue
+                entry.price_usd = price_usd
+                entry.liquidity = liquidity
+                entry.volume_24h_usd = volume_24h_usd
+                entry.price_change_24h_percentage = price_change_24h_percentage
+                entry.price_ts = price_ts
+
+    def set_icon(self, addr, icon_url, now, ttl=None):
+        with self._lock:
+            entry = self._entry(addr)
+            entry.icon_url = icon_url
+            entry.icon_expires = now + (self.icon_ttl if ttl is None else ttl)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, addr):
+        return addr in self._entries
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            }
@@ -0,0 +1,83 @@
+# === token_metadata.py ===
+
+import os
+import time
+from collections import namedtuple
+import db
+
+# Tokens GeckoTerminal has no icon for are re-checked sooner than real icons expire
+ICON_NEGATIVE_TTL = int(os.getenv("ICON_NEGATIVE_TTL", str(6 * 60 * 60)))
+
+TokenMetadata = namedtuple("TokenMetadata", ["icon_url", "symbol", "decimals", "last_checked"])
+
+_metadata = {}
+
+
+def get(addr):
+    return _metadata.get(addr)
+
+
+def symbol(addr, default=None):
+    meta = _metadata.get(addr)
+    return meta.symbol if meta and meta.symbol else default
+
+
+def decimals(addr, default=None):
+    meta = _metadata.get(addr)
+    return meta.decimals if meta and meta.decimals is not None else default
+
+
+def icon_ttl(meta, default_ttl):
+    return default_ttl if meta.icon_url else ICON_NEGATIVE_TTL
+
+
+async def load(token_cache):
+    # Fill the in-memory store and the icon side of the token cache from Postgres
+    if db.pool is None:
+        return 0
+    started = time.perf_counter()
+    rows = await db.pool.fetch("SELECT address, icon_url, symbol, decimals, last_checked FROM token_metadata")
+    now = time.time()
+    for row in rows:
+        meta = TokenMetadata(row["icon_url"], row["symbol"], row["decimals"], row["last_checked"].timestamp())
+        _metadata[row["address"]] = meta
+        ttl = icon_ttl(meta, token_cache.icon_ttl)
+        if meta.last_checked + ttl > now:
+            token_cache.set_icon(row["address"], meta.icon_url, meta.last_checked, ttl=ttl)
+    print(f"[METADATA] Loaded {len(rows)} tokens in {time.perf_counter() - started:.2f}s")
+    return len(rows)
+
+
+async def save_decimals(decimals_by_addr):
+    # Decimals read on-chain; whatever icon / symbol is already known is kept
+    entries = {}
+    for addr, value in decimals_by_addr.items():
+        meta = _metadata.get(addr) or TokenMetadata(None, None, None, 0)
+        entries[addr] = meta._replace(decimals=value)
+    await save(entries)
+
+
+async def save(entries):
+    # entries: {address: TokenMetadata}; a None symbol or decimals keeps the known value, as the upsert below does
+    for addr, meta in entries.items():
+        known = _metadata.get(addr)
+        if known is not None:
+            meta = meta._replace(
+                symbol=meta.symbol if meta.symbol is not None else known.symbol,
+                decimals=meta.decimals if meta.decimals is not None else known.decimals,
+            )
+        _metadata[addr] = meta
+    if db.pool is None or not entries:
+        return
+    try:
+        await db.pool.executemany("""
+            INSERT INTO token_metadata (address, icon_url, symbol, decimals, last_checked)
+            VALUES ($1, $2, $3, $4, to_timestamp($5))
+            ON CONFLICT (address) DO UPDATE SET
+                icon_url = EXCLUDED.icon_url,
+                symbol = COALESCE(EXCLUDED.symbol, token_metadata.symbol),
+                decimals = COALESCE(EXCLUDED.decimals, token_metadata.decimals),
+                last_checked = EXCLUDED.last_checked
+        """, [(addr, m.icon_url, m.symbol, m.decimals, m.last_checked) for addr, m in entries.items()])
+    except Exception as e:
+        print(f"[METADATA] Failed to persist {len(entries)} tokens: {repr(e)}")
@@ -0,0 +1,79 @@
+# === upstream.py ===
+
+import os
+from urllib.parse import urlsplit
+import httpx
+import deadline
+import metrics
+import ratelimit
+
+# Base URLs of the HTTP upstreams; point them at local stand-ins (bench/mock_upstreams.py) to run offline
+EXPLORER_API_URL = os.getenv("EXPLORER_API_URL", "https://explorer-pepe-unchained-gupg0lo9wf.t.conduit.xyz/api/v2").rstrip("/")
+GECKOTERMINAL_API_URL = os.getenv("GECKOTERMINAL_API_URL", "https://api.geckoterminal.com/api/v2").rstrip("/")
+ratelimit.set_host_limit(GECKOTERMINAL_API_URL, ratelimit.GECKO_RATE_PER_MIN / 60, ratelimit.GECKO_BURST)
+# Metric label per host[:port]
+_UPSTREAM_NAMES = {urlsplit(EXPLORER_API_URL).netloc: "explorer", urlsplit(GECKOTERMINAL_API_URL).netloc: "geckoterminal"}
+
+# One pooled client for every explorer / GeckoTerminal call, opened at startup and closed at shutdown
+DEFAULT_TIMEOUT = 15
+# How many times a 429 is re-queued behind the host's rate limiter before giving up
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", "3"))
+client = None
+
+
+def get_client():
+    global client
+    if client is None:
+        client = httpx.AsyncClient(
+            http2=True,
+            timeout=DEFAULT_TIMEOUT,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60),
+        )
+    return client
+
+
+async def start():
+    get_client()
+
+
+async def close():
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
+
+
+async def request(method, url, timeout=DEFAULT_TIMEOUT, **kwargs):
+    bucket = ratelimit.bucket_for(url)
+    name = _UPSTREAM_NAMES.get(urlsplit(url).netloc, "other")
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        # Both the rate-limit queue and the call itself are bounded by the request deadline, if any
+        await deadline.bounded(bucket.acquire())
+        try:
+            with metrics.upstream_call(name, method):
+                res = await get_client().request(method, url, timeout=deadline.clamp_timeout(timeout), **kwargs)
+        except httpx.TimeoutException:
+            left = deadline.remaining()
+            if left is not None and left <= 0:
+                raise deadline.DeadlineExceeded()
+            raise
+        metrics.upstream_status(name, method, res.status_code)
+        if res.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+            return res
+        delay = ratelimit.retry_after_seconds(res.headers.get("retry-after"))
+        print(f"[RATE LIMIT] 429 from {res.url.host}, pausing {delay:.1f}s")
+        bucket.pause(delay)
+    return res
+
+
+async def get_json(url, timeout=DEFAULT_TIMEOUT):
+    # An error body (including a 429 after the retries) must not read as an empty listing
+    res = await request("GET", url, timeout=timeout)
+    res.raise_for_status()
+    return res.json()
+
+
+async def post_json(url, payload, timeout=DEFAULT_TIMEOUT):
+    res = await request("POST", url, json=payload, timeout=timeout)
+    res.raise_for_status()
+    return res.json()
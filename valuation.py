@@ -0,0 +1,1092 @@
+# === valuation.py ===
+
+from web3 import Web3, AsyncWeb3
+import asyncio
+import random
+import time
+from decimal import Decimal
+import os
+import lp_math
+from multicall import CallCoalescer, RawCall
+import deadline
+import explorer
+import holdings
+import metrics
+import upstream
+from token_cache import TokenCache
+from singleflight import SingleFlight, BatchCoalescer
+import token_metadata
+from token_metadata import TokenMetadata
+import pool_metadata
+from pool_metadata import PoolMetadata
+
+RPC_URL = os.getenv("RPC_URL", "https://rpc-pepe-unchained-gupg0lo9wf.t.conduit.xyz")
+PEPU_ETH_INFO = f"{upstream.GECKOTERMINAL_API_URL}/networks/eth/tokens/0xadd39272e83895e7d3f244f696b7a25635f34234"
+TOKEN_BALANCE_API = f"{upstream.EXPLORER_API_URL}/addresses/{{}}/token-balances"
+NATIVE_BALANCE_API = f"{upstream.EXPLORER_API_URL}/addresses/{{}}"
+# Only used for LP positions, which are ERC-721; other NFT types would only add pages to walk
+NFT_API = f"{upstream.EXPLORER_API_URL}/addresses/{{}}/nft?type=ERC-721"
+BATCH_PRICE_API = f"{upstream.GECKOTERMINAL_API_URL}/simple/networks/pepe-unchained/token_price/{{}}?include_24hr_vol=true&include_24hr_price_change=true&include_total_reserve_in_usd=true"
+TOKEN_MULTI_INFO_API = f"{upstream.GECKOTERMINAL_API_URL}/networks/pepe-unchained/tokens/multi/{{}}"
+STAKING_CONTRACT = "0xf0163C18F8D3fC8D5b4cA15e07D0F9f75460335F"
+LP_MANAGER_ADDRESS = os.getenv("LP_MANAGER_ADDRESS", "0x5e7cda0b5f1d239e6ea03beaee12008ba4184782").lower()
+# Uniswap V3 pool reads, made as raw calls so forks with slightly different return layouts still decode
+SLOT0_SELECTOR = "0x3850c7bd"
+FEE_GROWTH_GLOBAL0_SELECTOR = "0xf3058399"
+FEE_GROWTH_GLOBAL1_SELECTOR = "0x46141319"
+TICKS_SELECTOR = "0xf30dba93"
+
+web3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(RPC_URL))
+web3.middleware_onion.add(metrics.rpc_middleware, "metrics")
+
+staking_abi = [
+    {
+        "name": "poolStakers",
+        "outputs": [
+            {"name": "", "type": "uint256"},
+            {"name": "rewardDebt", "type": "uint256"},
+            {"name": "lastRewardMultiplier", "type": "uint256"},
+            {"name": "lastUpdateTime", "type": "uint256"},
+        ],
+        "inputs": [{"name": "", "type": "address"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "name": "getRewards",
+        "outputs": [{"name": "", "type": "uint256"}],
+        "inputs": [{"name": "", "type": "address"}],
+        "stateMutability": "view",
+        "type": "function"
+    }
+]
+
+lp_manager_abi = [{
+    "name": "positions",
+    "type": "function",
+    "stateMutability": "view",
+    "inputs": [{"name": "tokenId", "type": "uint256"}],
+    "outputs": [
+        {"name": "nonce", "type": "uint96"},
+        {"name": "operator", "type": "address"},
+        {"name": "token0", "type": "address"},
+        {"name": "token1", "type": "address"},
+        {"name": "fee", "type": "uint24"},
+        {"name": "tickLower", "type": "int24"},
+        {"name": "tickUpper", "type": "int24"},
+        {"name": "liquidity", "type": "uint128"},
+        {"name": "feeGrowthInside0LastX128", "type": "uint256"},
+        {"name": "feeGrowthInside1LastX128", "type": "uint256"},
+        {"name": "tokensOwed0", "type": "uint128"},
+        {"name": "tokensOwed1", "type": "uint128"},
+    ]
+}, {
+    "name": "ownerOf",
+    "type": "function",
+    "stateMutability": "view",
+    "inputs": [{"name": "tokenId", "type": "uint256"}],
+    "outputs": [{"name": "", "type": "address"}]
+}, {
+    "name": "factory",
+    "type": "function",
+    "stateMutability": "view",
+    "inputs": [],
+    "outputs": [{"name": "", "type": "address"}]
+}]
+
+erc20_abi = [{
+    "constant": True,
+    "inputs": [{"name": "owner", "type": "address"}],
+    "name": "balanceOf",
+    "outputs": [{"name": "", "type": "uint256"}],
+    "payable": False,
+    "stateMutability": "view",
+    "type": "function"
+}, {
+    "constant": True,
+    "inputs": [],
+    "name": "decimals",
+    "outputs": [{"name": "", "type": "uint8"}],
+    "payable": False,
+    "stateMutability": "view",
+    "type": "function"
+}, {
+    "constant": True,
+    "inputs": [],
+    "name": "symbol",
+    "outputs": [{"name": "", "type": "string"}],
+    "payable": False,
+    "stateMutability": "view",
+    "type": "function"
+}, {
+    "constant": True,
+    "inputs": [],
+    "name": "name",
+    "outputs": [{"name": "", "type": "string"}],
+    "payable": False,
+    "stateMutability": "view",
+    "type": "function"
+}]
+
+staking_contract = web3.eth.contract(address=STAKING_CONTRACT, abi=staking_abi)
+lp_contract = web3.eth.contract(address=Web3.to_checksum_address(LP_MANAGER_ADDRESS), abi=lp_manager_abi)
+
+pepu_cache = {"price": None, "icon": None, "timestamp": 0}
+pepu_cache_stats = {"hits": 0, "misses": 0}
+CACHE_TTL = 300
+ICON_TTL = int(os.getenv("ICON_TTL", str(24 * 60 * 60)))
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "5000"))
+
+token_cache = TokenCache(max_entries=TOKEN_CACHE_MAX_ENTRIES, price_ttl=CACHE_TTL, icon_ttl=ICON_TTL)
+token_cache.pin_icon(
+    "0x4200000000000000000000000000000000000006",
+    "https://coin-images.coingecko.com/coins/images/52681/large/wn6wNj1C_400x400.jpg?1734021973"
+)
+
+# Concurrent requests share upstream fetches: one in-flight PEPU refresh, and token addresses
+# from different requests merged into the same price / metadata batches of 30
+PRICE_BATCH_WINDOW = float(os.getenv("PRICE_BATCH_WINDOW", "0.05"))
+upstream_flight = SingleFlight()
+# Contract reads from concurrent requests (or wallets in one batch request) share Multicall round trips
+RPC_BATCH_WINDOW = float(os.getenv("RPC_BATCH_WINDOW", "0.01"))
+rpc_batcher = CallCoalescer(web3, window=RPC_BATCH_WINDOW)
+
+# 429s are queued behind the per-host rate limiter in upstream; these retries only cover other failures
+LOG_MODE_RETRIES = int(os.getenv("LOG_MODE_RETRIES", "5"))
+LOG_MODE_RETRY_DELAY = float(os.getenv("LOG_MODE_RETRY_DELAY", "2"))
+MAX_RETRY_DELAY = float(os.getenv("MAX_RETRY_DELAY", "30"))
+
+def retry_backoff(attempt, delay):
+    # Exponential with full jitter, so failed batches from many callers do not retry in lockstep
+    return random.uniform(0, min(MAX_RETRY_DELAY, delay * 2 ** attempt))
+
+
+async def _fetch_icon_batch(batch):
+    url = TOKEN_MULTI_INFO_API.format("%2C".join(batch))
+    print(f"[ICON] Fetching: {url}")
+    data = (await upstream.get_json(url))["data"]
+    now = time.time()
+
+    found = {}
+    for item in data:
+        attributes = item.get("attributes", {})
+        addr = attributes.get("address", "").lower()
+        image_url = attributes.get("image_url")
+        # GeckoTerminal answers "missing.png" for tokens without an icon
+        if not image_url or "missing" in image_url:
+            image_url = None
+        decimals = attributes.get("decimals")
+        found[addr] = TokenMetadata(image_url, attributes.get("symbol"), int(decimals) if decimals is not None else None, now)
+
+    # Tokens GeckoTerminal does not know are negatively cached as "no icon"
+    entries = {addr: found.get(addr) or TokenMetadata(None, None, None, now) for addr in batch}
+    for addr, meta in entries.items():
+        token_cache.set_icon(addr, meta.icon_url, now, ttl=token_metadata.icon_ttl(meta, token_cache.icon_ttl))
+    await token_metadata.save(entries)
+    return batch
+
+icon_batcher = BatchCoalescer(_fetch_icon_batch, max_batch=30, window=PRICE_BATCH_WINDOW)
+
+async def populate_icon_cache(token_addrs, now, retries=1, delay=1.5):
+    remaining = list(token_addrs)
+    for attempt in range(retries):
+        next_try = await icon_batcher.load(remaining)
+        if not next_try:
+            break
+        await asyncio.sleep(retry_backoff(attempt, delay))
+        remaining = next_try
+
+async def _fetch_price_batch(batch):
+    url = BATCH_PRICE_API.format("%2C".join(batch))
+    print(f"[PRICE] Fetching: {url}")
+    res = (await upstream.get_json(url))["data"]["attributes"]
+    price_data = res["token_prices"]
+    liq_data = res["total_reserve_in_usd"]
+    vol_data = res.get("h24_volume_usd", {})
+    change_data = res.get("h24_price_change_percentage", {})
+    now = time.time()
+    for addr in batch:
+        token_cache.set_price(
+            addr,
+            float(price_data.get(addr, 0.0) or 0.0),
+            float(liq_data.get(addr, 0.0) or 0.0),
+            float(vol_data.get(addr, 0.0) or 0.0),
+            float(change_data.get(addr, 0.0) or 0.0),
+            now,
+        )
+    return batch
+
+price_batcher = BatchCoalescer(_fetch_price_batch, max_batch=30, window=PRICE_BATCH_WINDOW)
+
+async def populate_price_cache(token_addrs, now, retries=1, delay=1.5):
+    remaining = list(token_addrs)
+    for attempt in range(retries):
+        next_try = await price_batcher.load(remaining)
+        if not next_try:
+            break
+        await asyncio.sleep(retry_backoff(attempt, delay))
+        remaining = next_try
+
+
+async def _refresh_pepu_price(now, max_age=CACHE_TTL):
+    # Another caller may have refreshed it while we were queued
+    if now - pepu_cache["timestamp"] <= max_age:
+        return
+    for attempt in range(3):
+        try:
+            data = (await upstream.get_json(PEPU_ETH_INFO, timeout=5)).get("data", {})
+            attributes = data.get("attributes", {})
+
+            # Only update cache if data exists
+            if "price_usd" in attributes and "image_url" in attributes:
+                pepu_cache["price"] = float(attributes["price_usd"])
+                pepu_cache["icon"] = attributes["image_url"]
+                pepu_cache["timestamp"] = now
+                break
+        except Exception as e:
+            if attempt == 1:
+                print(f"[Warning] PEPU price fetch failed: {repr(e)}")
+        if attempt < 2:
+            await asyncio.sleep(retry_backoff(attempt, 1.5))
+
+async def refresh_pepu_price(now, max_age=CACHE_TTL):
+    if now - pepu_cache["timestamp"] > max_age:
+        await upstream_flight.do("pepu", lambda: _refresh_pepu_price(now, max_age))
+
+
+# Stale-while-revalidate: handlers only wait on the network for values never seen before.
+# Stale values are served (flagged "stale") while a background refresh runs.
+_background_tasks = set()
+
+async def _detached(coro):
+    deadline.clear()
+    return await coro
+
+def in_background(coro):
+    task = asyncio.ensure_future(_detached(coro))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def ensure_prices(token_addrs, now, log_mode=False):
+    stale = token_cache.stale_prices(token_addrs, now)
+    if log_mode:
+        # History snapshots want fresh values and are not user-facing
+        await populate_price_cache(stale, now, retries=LOG_MODE_RETRIES, delay=LOG_MODE_RETRY_DELAY)
+        return
+    cold = [addr for addr in stale if not token_cache.has_price(addr)]
+    if len(cold) < len(stale):
+        in_background(populate_price_cache([addr for addr in stale if addr not in cold], now))
+    if cold:
+        await populate_price_cache(cold, now)
+
+async def ensure_pepu_price(now, log_mode=False):
+    fresh = pepu_cache["price"] is not None and now - pepu_cache["timestamp"] <= CACHE_TTL
+    pepu_cache_stats["hits" if fresh else "misses"] += 1
+    if pepu_cache["price"] is None or log_mode:
+        await refresh_pepu_price(now)
+    elif now - pepu_cache["timestamp"] > CACHE_TTL:
+        in_background(refresh_pepu_price(now))
+
+
+# Latest block, shared by every request for BLOCK_CACHE_TTL so RPC reads per response are pinned to one block
+BLOCK_CACHE_TTL = float(os.getenv("BLOCK_CACHE_TTL", "1.0"))
+_block_cache = {"number": None, "timestamp": 0}
+
+async def _fetch_block_number():
+    _block_cache["number"] = await web3.eth.block_number
+    _block_cache["timestamp"] = time.time()
+    return _block_cache["number"]
+
+async def current_block():
+    if _block_cache["number"] is not None and time.time() - _block_cache["timestamp"] < BLOCK_CACHE_TTL:
+        return _block_cache["number"]
+    return await upstream_flight.do("block_number", _fetch_block_number)
+
+
+async def get_portfolio(wallet, log_mode=False, block_identifier="latest", emit=None):
+    now = time.time()
+    
+    try:
+        checksum_wallet = Web3.to_checksum_address(wallet)
+    except:
+        return {"error": "Invalid wallet address format."}
+        
+    # Native balance, token list, staking reads and the PEPU price are independent.
+    # Whatever is not done by the request deadline is left out and listed under "pending".
+    pending = []
+    # Indexed wallets skip the explorer entirely: balances come from Postgres and the native balance from the RPC
+    indexed = await holdings.ready(wallet, block_identifier)
+    sections = await metrics.timed("portfolio.balances", deadline.gather_sections(
+        native=web3.eth.get_balance(checksum_wallet, block_identifier) if indexed else upstream.get_json(NATIVE_BALANCE_API.format(wallet)),
+        tokens=holdings.token_balances(wallet) if indexed else explorer.fetch_all(TOKEN_BALANCE_API.format(wallet)),
+        staking=rpc_batcher.call([
+            staking_contract.functions.poolStakers(checksum_wallet),
+            staking_contract.functions.getRewards(checksum_wallet),
+        ], block_identifier),
+        pepu=ensure_pepu_price(now, log_mode),
+    ))
+
+    native = 0
+    if deadline.failed(sections["native"]):
+        pending.append(deadline.marker("native_pepu", sections["native"]))
+    else:
+        native_wei = sections["native"] if indexed else int(sections["native"].get("coin_balance", 0))
+        native = native_wei / 1e18
+
+    staked = rewards = 0
+    if deadline.failed(sections["staking"]):
+        pending.append(deadline.marker("staked_pepu", sections["staking"]))
+        pending.append(deadline.marker("unclaimed_rewards", sections["staking"]))
+    else:
+        staked_res, rewards_res = sections["staking"]
+        try:
+            staked_raw = staked_res.value
+            staked = staked_raw / 1e18 if isinstance(staked_raw, int) else staked_raw[0] / 1e18
+        except:
+            staked = 0
+        rewards = rewards_res.value / 1e18 if rewards_res.success else 0
+
+    if pepu_cache["price"] is None:
+        pending.append(deadline.marker("pepu_price", sections["pepu"], status="pending"))
+    pepu_price = pepu_cache["price"] or 0.0
+    pepu_icon = pepu_cache["icon"] or "https://placehold.co/32x32"
+    pepu_stale = now - pepu_cache["timestamp"] > CACHE_TTL
+    
+    result = {
+        "native_pepu": {
+            "label": "Wallet Balance",
+            "amount": native,
+            "price_usd": pepu_price,
+            "total_usd": native * pepu_price,
+            "icon": pepu_icon,
+            "stale": pepu_stale
+        },
+        "staked_pepu": {
+            "label": "Staked PEPU",
+            "amount": staked,
+            "price_usd": pepu_price,
+            "total_usd": staked * pepu_price,
+            "icon": pepu_icon,
+            "stale": pepu_stale
+        },
+        "unclaimed_rewards": {
+            "label": "Unclaimed Rewards",
+            "amount": rewards,
+            "price_usd": pepu_price,
+            "total_usd": rewards * pepu_price,
+            "icon": pepu_icon,
+            "stale": pepu_stale
+        },
+        "tokens": [],
+        "total_value_usd": 0.0,
+        "pending": pending
+    }
+
+    total = result["native_pepu"]["total_usd"] + result["staked_pepu"]["total_usd"] + result["unclaimed_rewards"]["total_usd"]
+    # Streaming callers get the PEPU sections now, before the token price pass
+    if emit:
+        for section in ("native_pepu", "staked_pepu", "unclaimed_rewards"):
+            emit(section, result[section])
+
+    tokens = []
+    if deadline.failed(sections["tokens"]):
+        pending.append(deadline.marker("tokens", sections["tokens"]))
+    else:
+        tokens = [t for t in sections["tokens"] if t["token"]["address"].lower() != LP_MANAGER_ADDRESS.lower()]    #Exclude LP tokens
+    token_addrs = [t["token"]["address"].lower() for t in tokens]
+    
+    # Determine missing icons
+    missing_icons = token_cache.missing_icons(token_addrs, now)
+    
+    # Fetch icons and price+liquidity (in batches of 30) concurrently
+    if not log_mode:
+        fetched = await metrics.timed("portfolio.prices", deadline.gather_sections(icons=populate_icon_cache(missing_icons, now), prices=ensure_prices(token_addrs, now)))
+    else:
+        fetched = await metrics.timed("portfolio.prices", deadline.gather_sections(prices=ensure_prices(token_addrs, now, log_mode=True)))
+    if deadline.failed(fetched["prices"]):
+        unpriced = [addr for addr in token_addrs if not token_cache.has_price(addr)]
+        if unpriced:
+            pending.append({**deadline.marker("token_prices", fetched["prices"], status="pending"), "tokens": unpriced})
+    
+    # Now use the populated cache to build the response
+    for t in tokens:
+        tok = t["token"]
+        addr = tok["address"].lower()
+        symbol = tok.get("symbol", "")
+        name = tok.get("name", "Unknown")
+        decimals = int(tok.get("decimals", 18)) if tok.get("decimals") else 18
+        amount = int(t["value"]) / (10 ** decimals)
+    
+        info = token_cache.get(addr, now)
+        price = info.get("price_usd", 0.0)
+        liquidity = info.get("liquidity", 0.0)
+        volume_24h_usd = info.get("volume_24h_usd", 0.0)
+        price_change_24h_percentage = info.get("price_change_24h_percentage", 0.0)
+        icon = info.get("icon_url") or "https://placehold.co/32x32"
+    
+        warning = None
+        if price == 0.0:
+            warning = "Error fetching price data"
+        elif liquidity < 1000:
+            warning = "Low liquidity pool"
+            price = 0.0
+    
+        total_usd = amount * price if price else 0.0
+        if price:
+            total += total_usd
+    
+        result["tokens"].append({
+            "name": name,
+            "symbol": symbol,
+            "contract": addr,
+            "amount": amount,
+            "price_usd": price,
+            "total_usd": total_usd,
+            "volume_24h_usd": volume_24h_usd,
+            "price_change_24h_percentage": price_change_24h_percentage,
+            "icon_url": icon,
+            "warning": warning,
+            "stale": token_cache.is_stale(info, now)
+        })
+        
+    result["tokens"].sort(key=lambda x: x["total_usd"], reverse=True)
+    result["total_value_usd"] = round(total, 2)
+    result["partial"] = bool(pending)
+    if emit:
+        emit("tokens", result["tokens"])
+    return result
+
+_erc20_contracts = {}
+
+def erc20_contract(addr):
+    contract = _erc20_contracts.get(addr)
+    if contract is None:
+        contract = _erc20_contracts[addr] = web3.eth.contract(address=Web3.to_checksum_address(addr), abi=erc20_abi)
+    return contract
+
+def _word(value):
+    # ABI-encode a (possibly negative) integer argument as one 32-byte word
+    return (value % 2 ** 256).to_bytes(32, "big")
+
+def _words(data):
+    return [int.from_bytes(data[i:i + 32], "big") for i in range(0, len(data), 32)]
+
+def _signed(word):
+    return word - 2 ** 256 if word >= 2 ** 255 else word
+
+def lp_error(item, e):
+    return {
+        "token_id": item.get("id"),
+        "token0": item.get("token0", "Unknown"),
+        "token1": item.get("token1", "Unknown"),
+        "symbol0": item.get("symbol0", "Unknown"),
+        "symbol1": item.get("symbol1", "Unknown"),
+        "pool_address": item.get("metadata", {}).get("description", "Unknown"),
+        "lp_name": item.get("metadata", {}).get("name", "Unknown LP"),
+        "amount0": 0,
+        "amount1": 0,
+        "fees0": 0,
+        "fees1": 0,
+        "amount0_usd": 0,
+        "amount1_usd": 0,
+        "fees_usd": 0,
+        "warning": f"Failed to get LP data: {repr(e)}"
+    }
+
+factory_abi = [{
+    "name": "getPool",
+    "type": "function",
+    "stateMutability": "view",
+    "inputs": [
+        {"name": "tokenA", "type": "address"},
+        {"name": "tokenB", "type": "address"},
+        {"name": "fee", "type": "uint24"}
+    ],
+    "outputs": [{"name": "", "type": "address"}]
+}]
+_factory = None
+
+async def resolve_position_pools(positions, block_identifier="latest"):
+    # positions: {token_id: positions() result} for LP positions with no NFT description to parse.
+    # The pool index in Postgres is asked first (another worker may have indexed them), then the factory.
+    global _factory
+    missing = await pool_metadata.load_positions([token_id for token_id in positions if pool_metadata.for_position(token_id) is None])
+    if not missing:
+        return
+    if _factory is None:
+        factory_address = await lp_contract.functions.factory().call()
+        _factory = web3.eth.contract(address=factory_address, abi=factory_abi)
+    keys = sorted({(positions[token_id][2].lower(), positions[token_id][3].lower(), positions[token_id][4]) for token_id in missing})
+    results = await rpc_batcher.call([
+        _factory.functions.getPool(Web3.to_checksum_address(t0), Web3.to_checksum_address(t1), fee) for t0, t1, fee in keys
+    ], block_identifier)
+    pool_by_key = {key: res.value.lower() for key, res in zip(keys, results) if res.success}
+
+    pools, position_pools = {}, {}
+    for token_id in missing:
+        pos = positions[token_id]
+        key = (pos[2].lower(), pos[3].lower(), pos[4])
+        pool_address = pool_by_key.get(key)
+        if pool_address is None:
+            continue
+        if pool_metadata.get(pool_address) is None and pool_address not in pools:
+            t0, t1, fee = key
+            pools[pool_address] = PoolMetadata(
+                pool_address, t0, t1, token_metadata.symbol(t0), token_metadata.symbol(t1),
+                token_metadata.decimals(t0), token_metadata.decimals(t1), fee
+            )
+        position_pools[token_id] = pool_address
+    await pool_metadata.save(pools, position_pools)
+
+async def get_lp_positions(wallet, log_mode=False, block_identifier="latest", emit=None):
+    now = time.time()
+
+    total_lp = 0.0
+    
+    try:
+        checksum_wallet = Web3.to_checksum_address(wallet)
+    except:
+        return {"error": "Invalid wallet address format."}
+        
+    result = {
+        "lp_positions": [],
+        "total_value_usd": 0.0,
+        "pending": []
+    }
+
+    # LP NFT positions
+    try:
+        # Round 1: positions() for each page's LP NFTs is requested as soon as that page arrives, while the
+        # next page is still loading; reads from pages that land close together share a Multicall
+        lp_items = []
+        position_reads = []
+
+        def read_positions(items):
+            lp_items.extend(items)
+            position_reads.append(asyncio.ensure_future(rpc_batcher.call([lp_contract.functions.positions(int(item["id"])) for item in items], block_identifier)))
+
+        nft_pages = explorer.Pages(NFT_API.format(wallet), timeout=15)
+        with metrics.phase("lp.positions"):
+            try:
+                if await holdings.ready(wallet, block_identifier):
+                    # Indexed wallets: position IDs come from Postgres, and the indexer has put their pools in the pool index
+                    read_positions([{"id": str(token_id), "token": {"address": LP_MANAGER_ADDRESS}} for token_id in await holdings.lp_token_ids(wallet)])
+                else:
+                    async for page in nft_pages:
+                        items = [item for item in page if item.get("token", {}).get("address", "").lower() == LP_MANAGER_ADDRESS.lower()]
+                        if items:
+                            read_positions(items)
+                position_results = [res for page in await deadline.bounded(asyncio.gather(*position_reads)) for res in page]
+            except BaseException:
+                for read in position_reads:
+                    read.cancel()
+                raise
+        if nft_pages.truncated:
+            result["warning"] = f"Only the first {nft_pages.pages} pages of NFTs were checked for LP positions"
+
+        # Indexed positions carry no NFT description; a pool the leader indexed after this worker started is
+        # looked up in Postgres, or on-chain through the factory
+        undescribed = {
+            int(item["id"]): res.value for item, res in zip(lp_items, position_results)
+            if res.success and not item.get("metadata", {}).get("description") and pool_metadata.for_position(int(item["id"])) is None
+        }
+        if undescribed:
+            try:
+                await metrics.timed("lp.pool_index", deadline.bounded(resolve_position_pools(undescribed, block_identifier)))
+            except Exception as e:
+                print(f"[LP] Could not resolve pools for {len(undescribed)} indexed positions: {repr(e)}")
+
+        new_pools, new_positions = {}, {}
+
+        def pool_for(item, pos):
+            # Index first; the NFT description is parsed only the first time a position is seen
+            token_id = int(item["id"])
+            meta = pool_metadata.for_position(token_id)
+            if meta is None:
+                pool_address, symbols = pool_metadata.parse_description(item.get("metadata", {}).get("description", ""))
+                if pool_address is None:
+                    raise ValueError("pool unknown for position")
+                meta = pool_metadata.get(pool_address) or new_pools.get(pool_address)
+                if meta is None:
+                    token0, token1 = pos[2].lower(), pos[3].lower()
+                    meta = new_pools[pool_address] = PoolMetadata(
+                        pool_address, token0, token1, symbols.get(token0), symbols.get(token1),
+                        token_metadata.decimals(token0), token_metadata.decimals(token1), pos[4]
+                    )
+                new_positions[token_id] = pool_address
+            return meta
+
+        def process_lp(item, pos_res):
+            # Position fields from positions(); amounts and fees are filled in once pool state is known
+            try:
+                if not pos_res.success:
+                    raise pos_res.error
+                pos = pos_res.value
+                # Zero liquidity with tokens still owed is a withdrawn but uncollected position
+                if pos[7] == 0 and pos[10] == 0 and pos[11] == 0:
+                    return None
+
+                meta = pool_for(item, pos)
+
+                symbol0 = meta.symbol0 or token_metadata.symbol(meta.token0, "?")
+                symbol1 = meta.symbol1 or token_metadata.symbol(meta.token1, "?")
+                return {
+                    "token_id": int(item["id"]),
+                    "token0": Web3.to_checksum_address(meta.token0),
+                    "token1": Web3.to_checksum_address(meta.token1),
+                    "symbol0": symbol0,
+                    "symbol1": symbol1,
+                    "pool_address": Web3.to_checksum_address(meta.pool_address),
+                    # Indexed positions carry no NFT metadata
+                    "lp_name": item.get("metadata", {}).get("name", f"{symbol0}/{symbol1} {meta.fee / 10000:g}%"),
+                    "fee": meta.fee,
+                    "in_range": None,
+                    "amount0": 0,
+                    "amount1": 0,
+                    "fees0": 0,
+                    "fees1": 0,
+                    "amount0_usd": 0,
+                    "amount1_usd": 0,
+                    "fees_usd": 0,
+                    "warning": None
+                }, pos, meta
+
+            except Exception as e:
+                return lp_error(item, e), None, None
+
+        parsed = [process_lp(item, pos_res) for item, pos_res in zip(lp_items, position_results)]
+        parsed = [p for p in parsed if p]
+        live = [(lp, pos, meta) for lp, pos, meta in parsed if pos is not None]
+        result["lp_positions"].extend(lp for lp, pos, _ in parsed if pos is None)
+
+        # Round 2: pool state once per distinct pool, both boundary ticks per position, and decimals only for
+        # tokens of pools the index does not know completely yet, all in one batch
+        pool_addresses = sorted({lp["pool_address"] for lp, _, _ in live})
+        tick_keys = sorted({(lp["pool_address"], tick) for lp, pos, _ in live for tick in (pos[5], pos[6])})
+        unknown_decimals = sorted({
+            token for _, _, meta in live if not pool_metadata.complete(meta)
+            for token in (meta.token0, meta.token1) if token_metadata.decimals(token) is None
+        })
+        calls = [RawCall(pool, selector) for pool in pool_addresses for selector in (SLOT0_SELECTOR, FEE_GROWTH_GLOBAL0_SELECTOR, FEE_GROWTH_GLOBAL1_SELECTOR)]
+        calls += [RawCall(pool, TICKS_SELECTOR + _word(tick).hex()) for pool, tick in tick_keys]
+        calls += [erc20_contract(addr).functions.decimals() for addr in unknown_decimals]
+        state = await metrics.timed("lp.pool_state", deadline.bounded(rpc_batcher.call(calls, block_identifier)))
+
+        pool_state = {}
+        for i, pool in enumerate(pool_addresses):
+            slot0_res, growth0_res, growth1_res = state[3 * i:3 * i + 3]
+            if slot0_res.success and growth0_res.success and growth1_res.success:
+                slot0 = _words(slot0_res.value)
+                pool_state[pool] = (slot0[0], _signed(slot0[1]), _words(growth0_res.value)[0], _words(growth1_res.value)[0])
+        offset = 3 * len(pool_addresses)
+        tick_state = {key: _words(res.value)[2:4] for key, res in zip(tick_keys, state[offset:offset + len(tick_keys)]) if res.success}
+        offset += len(tick_keys)
+        await token_metadata.save_decimals({addr: res.value for addr, res in zip(unknown_decimals, state[offset:]) if res.success})
+
+        # New pools, and pools whose decimals just became known, go into the persistent index
+        for meta in {meta for _, _, meta in live if not pool_metadata.complete(meta)}:
+            filled = meta._replace(decimals0=token_metadata.decimals(meta.token0), decimals1=token_metadata.decimals(meta.token1))
+            if pool_metadata.complete(filled) or meta.pool_address in new_pools:
+                new_pools[meta.pool_address] = filled
+        await pool_metadata.save(new_pools, new_positions)
+
+        valued = []
+        for lp, pos, meta in live:
+            if lp["pool_address"] in pool_state:
+                valued.append((lp, pos, pool_metadata.get(meta.pool_address) or meta))
+            else:
+                lp["warning"] = "Failed to get LP data: pool state unavailable"
+            result["lp_positions"].append(lp)
+
+        def decimals(meta):
+            return (
+                meta.decimals0 if meta.decimals0 is not None else token_metadata.decimals(meta.token0, 18),
+                meta.decimals1 if meta.decimals1 is not None else token_metadata.decimals(meta.token1, 18),
+            )
+
+        # Principal for every position in one vectorized pass
+        if valued:
+            amounts0, amounts1 = lp_math.position_amounts(
+                [pos[7] for _, pos, _ in valued],
+                [pos[5] for _, pos, _ in valued],
+                [pos[6] for _, pos, _ in valued],
+                [pool_state[lp["pool_address"]][0] for lp, _, _ in valued],
+                [decimals(meta)[0] for _, _, meta in valued],
+                [decimals(meta)[1] for _, _, meta in valued],
+            )
+        for i, (lp, pos, meta) in enumerate(valued):
+            sqrt_price, tick, growth_global0, growth_global1 = pool_state[lp["pool_address"]]
+            tick_lower, tick_upper, liquidity = pos[5], pos[6], pos[7]
+            lp["amount0"] = float(amounts0[i])
+            lp["amount1"] = float(amounts1[i])
+            lp["in_range"] = tick_lower <= tick < tick_upper
+
+            # Uncollected fees need exact 256-bit fee growth math, so they stay in Python ints
+            lower = tick_state.get((lp["pool_address"], tick_lower))
+            upper = tick_state.get((lp["pool_address"], tick_upper))
+            if lower is None or upper is None:
+                fees0, fees1 = pos[10], pos[11]
+            else:
+                inside0 = lp_math.fee_growth_inside(tick, tick_lower, tick_upper, growth_global0, lower[0], upper[0])
+                inside1 = lp_math.fee_growth_inside(tick, tick_lower, tick_upper, growth_global1, lower[1], upper[1])
+                fees0 = lp_math.uncollected_fees(liquidity, inside0, pos[8], pos[10])
+                fees1 = lp_math.uncollected_fees(liquidity, inside1, pos[9], pos[11])
+            decimals0, decimals1 = decimals(meta)
+            lp["fees0"] = fees0 / 10 ** decimals0
+            lp["fees1"] = fees1 / 10 ** decimals1
+
+        # Icons and stale prices for every token seen across all positions
+        lp_tokens = {lp[key].lower() for lp in result["lp_positions"] if not lp.get("warning") for key in ("token0", "token1")}
+        # Price+liquidity for every LP token (stale values are revalidated in the background)
+        if not log_mode:
+            fetched = await metrics.timed("lp.prices", deadline.gather_sections(icons=populate_icon_cache(token_cache.missing_icons(lp_tokens, now), now), prices=ensure_prices(lp_tokens, now)))
+        else:
+            fetched = await metrics.timed("lp.prices", deadline.gather_sections(prices=ensure_prices(lp_tokens, now, log_mode=True)))
+        if deadline.failed(fetched["prices"]):
+            unpriced = [addr for addr in lp_tokens if not token_cache.has_price(addr)]
+            if unpriced:
+                result["pending"].append({**deadline.marker("lp_prices", fetched["prices"], status="pending"), "tokens": unpriced})
+        for lp in result["lp_positions"]:
+            if not lp.get("warning"):
+                lp["token0_icon"] = token_cache.get(lp["token0"].lower()).get("icon_url", "https://placehold.co/32x32")
+                lp["token1_icon"] = token_cache.get(lp["token1"].lower()).get("icon_url", "https://placehold.co/32x32")
+    
+        # Final price + USD calc
+        for lp in result["lp_positions"]:
+            token0 = lp["token0"].lower()
+            token1 = lp["token1"].lower()
+            info0 = token_cache.get(token0, now)
+            info1 = token_cache.get(token1, now)
+            price0 = info0.get("price_usd", 0.0)
+            price1 = info1.get("price_usd", 0.0)
+            lp["stale"] = token_cache.is_stale(info0, now) or token_cache.is_stale(info1, now)
+    
+            if price0 == 0.0 or price1 == 0.0:
+                if not lp.get("warning"):
+                    lp["warning"] = "Error fetching price data"
+                lp["amount0_usd"] = 0
+                lp["amount1_usd"] = 0
+                lp["fees_usd"] = 0
+            else:
+                lp["amount0_usd"] = lp["amount0"] * price0
+                lp["amount1_usd"] = lp["amount1"] * price1
+                lp["fees_usd"] = lp["fees0"] * price0 + lp["fees1"] * price1
+                total_lp += lp["amount0_usd"] + lp["amount1_usd"] + lp["fees_usd"]
+            if emit:
+                emit("lp_position", lp)
+    
+    except deadline.DeadlineExceeded:
+        result["pending"].append(deadline.marker("lp_positions"))
+    except Exception as e:
+        # Marked pending so an upstream failure is neither cached nor logged to history as "no LP positions"
+        result["lp_positions"].append({"error": f"Failed to fetch LPs: {str(e)}"})
+        result["pending"].append(deadline.marker("lp_positions", e))
+
+    result["lp_positions"].sort(key=lambda x: x.get("amount0_usd", 0) + x.get("amount1_usd", 0) + x.get("fees_usd", 0), reverse=True)
+    result["total_value_usd"] = round(total_lp, 2)
+    result["partial"] = bool(result["pending"])
+    return result
+
+
+
+
+# Structure: (staking_contract_address, pool_id, token_label)
+STAKING_POOLS = [
+    {
+        "contract_address": Web3.to_checksum_address("0x99618fE301BabC0929D956018d8cfB9938810AeC"),
+        "pool_id": 0,
+        "token_label": "$777 Pool 0"
+    },
+    {
+        "contract_address": Web3.to_checksum_address("0x99618fE301BabC0929D956018d8cfB9938810AeC"),
+        "pool_id": 1,
+        "token_label": "$777 Pool 1"
+    }
+]
+
+multi_staking_abi = [
+    {
+        "name": "pools",
+        "inputs": [{"name": "id", "type": "uint256"}],
+        "outputs": [
+            {"name": "stakingToken", "type": "address"},
+            {"name": "rewardToken", "type": "address"},
+            {"name": "apyBasisPoints", "type": "uint256"},
+            {"name": "maxRewardDuration", "type": "uint256"},
+            {"name": "lockDuration", "type": "uint256"},
+            {"name": "lockStaking", "type": "bool"},
+            {"name": "allowRestake", "type": "bool"},
+            {"name": "totalStaked", "type": "uint256"},
+            {"name": "active", "type": "bool"}
+        ],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "name": "stakes",
+        "inputs": [{"name": "poolId", "type": "uint256"}, {"name": "user", "type": "address"}],
+        "outputs": [
+            {"name": "amount", "type": "uint256"},
+            {"name": "timestamp", "type": "uint256"},
+            {"name": "unclaimed", "type": "uint256"}
+        ],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "name": "pendingRewards",
+        "inputs": [{"name": "poolId", "type": "uint256"}, {"name": "user", "type": "address"}],
+        "outputs": [{"name": "", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function"
+    }
+]
+
+multi_staking_contracts = {
+    address: web3.eth.contract(address=address, abi=multi_staking_abi)
+    for address in {entry["contract_address"] for entry in STAKING_POOLS}
+}
+
+async def get_staking(wallet, log_mode=False, block_identifier="latest"):
+    try:
+        checksum_wallet = Web3.to_checksum_address(wallet)
+    except:
+        return {"error": "Invalid wallet address format."}
+
+    now = time.time()
+    staking_results = []
+
+    # One batch for every pool: (pools, stakes, pendingRewards) per entry
+    calls = []
+    for entry in STAKING_POOLS:
+        contract = multi_staking_contracts[entry["contract_address"]]
+        calls += [
+            contract.functions.pools(entry["pool_id"]),
+            contract.functions.stakes(entry["pool_id"], checksum_wallet),
+            contract.functions.pendingRewards(entry["pool_id"], checksum_wallet),
+        ]
+    try:
+        call_results = await metrics.timed("staking.calls", deadline.bounded(rpc_batcher.call(calls, block_identifier)))
+    except deadline.DeadlineExceeded:
+        return {"staking_pools": [], "total_value_usd": 0.0, "pending": [deadline.marker("staking_pools")], "partial": True}
+
+    # Icons and prices for every staking token in one pass
+    pending_sections = []
+    staking_tokens = {
+        Web3.to_checksum_address(call_results[3 * i].value[0]).lower()
+        for i in range(len(STAKING_POOLS)) if call_results[3 * i].success
+    }
+    if not log_mode:
+        fetched = await metrics.timed("staking.prices", deadline.gather_sections(icons=populate_icon_cache(token_cache.missing_icons(staking_tokens, now), now), prices=ensure_prices(staking_tokens, now)))
+    else:
+        fetched = await metrics.timed("staking.prices", deadline.gather_sections(prices=ensure_prices(staking_tokens, now, log_mode=True)))
+    if deadline.failed(fetched["prices"]):
+        unpriced = [addr for addr in staking_tokens if not token_cache.has_price(addr)]
+        if unpriced:
+            pending_sections.append({**deadline.marker("staking_prices", fetched["prices"], status="pending"), "tokens": unpriced})
+
+    for i, entry in enumerate(STAKING_POOLS):
+        try:
+            pool_id = entry["pool_id"]
+            label = entry["token_label"]
+
+            pool_res, stake_res, pending_res = call_results[3 * i:3 * i + 3]
+            for res in (pool_res, stake_res, pending_res):
+                if not res.success:
+                    raise res.error
+            pool, stake, pending = pool_res.value, stake_res.value, pending_res.value
+
+            staking_token = Web3.to_checksum_address(pool[0])
+            apy = pool[2] / 100
+            lock_duration = pool[4]
+            amount_staked = stake[0] / 1e18
+            timestamp = stake[1]
+            pending_rewards = pending / 1e18
+
+            token_key = staking_token.lower()
+            info = token_cache.get(token_key, now)
+            price_usd = info.get("price_usd", 0.0)
+            icon_url = info.get("icon_url", "https://placehold.co/32x32")
+
+            remaining_lock = max(0, lock_duration - (int(now) - timestamp)) if timestamp else 0
+            total_value = (amount_staked + pending_rewards) * price_usd
+
+            staking_results.append({
+                "contract": entry["contract_address"],
+                "pool_id": pool_id,
+                "pool_name": label,
+                "token_address": staking_token,
+                "icon_url": icon_url,
+                "price_usd": price_usd,
+                "apy": apy,
+                "lock_duration": lock_duration,
+                "remaining_lock_time": remaining_lock,
+                "staked_amount": amount_staked,
+                "pending_rewards": pending_rewards,
+                "total_value_usd": round(total_value, 4),
+                "stale": token_cache.is_stale(info, now)
+            })
+
+        except Exception as e:
+            staking_results.append({
+                "contract": entry["contract_address"],
+                "pool_id": entry["pool_id"],
+                "pool_name": entry["token_label"],
+                "error": f"Failed to fetch staking data: {str(e)}"
+            })
+
+    total_usd = sum(p.get("total_value_usd", 0) for p in staking_results if isinstance(p, dict) and "total_value_usd" in p)
+    return {
+        "staking_pools": staking_results,
+        "total_value_usd": round(total_usd, 2),
+        "pending": pending_sections,
+        "partial": bool(pending_sections)
+    }
+
+
+
+
+PESW_PRESALE_CA = Web3.to_checksum_address("0xcE4268fB5908dAf59c198Ef26ef3f78949bf772C")
+PESW_STAKING_MANAGER_CA = Web3.to_checksum_address("0xDd6f17b253eDc9e3D7329FB6EA293DbF8b4c214d")
+
+# ABIs
+pesw_presale_abi = [
+    {"name": "getUserDeposits", "inputs": [{"name": "user", "type": "bytes"}], "outputs": [{"type": "uint256"}], "stateMutability": "view", "type": "function"},
+    {"name": "currentStep", "inputs": [], "outputs": [{"type": "uint256"}], "stateMutability": "view", "type": "function"},
+    {
+        "name": "rounds",
+        "inputs": [
+            {"name": "", "type": "uint256"},
+            {"name": "", "type": "uint256"}
+        ],
+        "outputs": [{"name": "", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function"
+    }
+]
+
+pesw_staking_abi = [
+    {"name": "getPoolStakers", "inputs": [{"name": "user", "type": "bytes"}], "outputs": [
+        {"type": "uint256"}, {"type": "uint256"}, {"type": "uint256"}, {"type": "uint256"}, {"type": "uint256"}
+    ], "stateMutability": "view", "type": "function"},
+    {"name": "getRewards", "inputs": [{"name": "_user", "type": "bytes"}], "outputs": [{"type": "uint256"}], "stateMutability": "view", "type": "function"},
+]
+
+pesw_presale_contract = web3.eth.contract(address=PESW_PRESALE_CA, abi=pesw_presale_abi)
+pesw_staking_contract = web3.eth.contract(address=PESW_STAKING_MANAGER_CA, abi=pesw_staking_abi)
+
+async def get_presales(wallet, log_mode=False, block_identifier="latest"):
+    try:
+        wallet_bytes = bytes.fromhex(wallet[2:])
+        # Deposits, staking info and current step in one batch; the round price depends on the step
+        results = await metrics.timed("presales.calls", deadline.bounded(rpc_batcher.call([
+            pesw_presale_contract.functions.getUserDeposits(wallet_bytes),
+            pesw_staking_contract.functions.getPoolStakers(wallet_bytes),
+            pesw_staking_contract.functions.getRewards(wallet_bytes),
+            pesw_presale_contract.functions.currentStep(),
+        ], block_identifier)))
+        for res in results:
+            if not res.success:
+                raise res.error
+        deposits_raw, staked_info, rewards_raw, current_step = (res.value for res in results)
+
+        deposits = deposits_raw / 1e18
+        staked_amount = staked_info[0] / 1e18
+        pending_rewards = rewards_raw / 1e18
+
+        # Price info
+        (round_res,) = await deadline.bounded(rpc_batcher.call([pesw_presale_contract.functions.rounds(1, current_step)], block_identifier))
+        if not round_res.success:
+            raise round_res.error
+        current_price = round_res.value / 1e18
+
+        pesw_total_value_usd = (deposits + staked_amount + pending_rewards) * current_price
+
+        return {
+            "pesw": {
+                "icon": "https://www.pepesquid.world/_next/image?url=%2Ficons%2Fpesw_icon-72.png&w=256&q=75",
+                "deposited_tokens": deposits,
+                "staked_tokens": staked_amount,
+                "pending_rewards": pending_rewards,
+                "current_price_usd": current_price,
+                "launch_price_usd": 0.01155
+            },
+            "total_value_usd": pesw_total_value_usd
+        }
+    except deadline.DeadlineExceeded:
+        return {"total_value_usd": 0, "pending": [deadline.marker("pesw")], "partial": True}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+# Multi-wallet dashboard: every section for every wallet in one request
+MAX_BATCH_WALLETS = int(os.getenv("MAX_BATCH_WALLETS", "25"))
+
+WALLET_SECTIONS = {
+    "portfolio": get_portfolio,
+    "lp_positions": get_lp_positions,
+    "staking": get_staking,
+    "presales": get_presales,
+}
+
+def parse_wallets(wallets_str):
+    wallets = []
+    for w in wallets_str.split(","):
+        w = w.strip().lower()
+        if w.startswith("0x") and len(w) == 42 and w not in wallets:
+            wallets.append(w)
+    return wallets
+
+async def get_wallets(wallets_str, log_mode=False, block_identifier="latest"):
+    wallets = parse_wallets(wallets_str)
+    if not wallets:
+        return {"error": "No valid wallet addresses provided."}
+    if len(wallets) > MAX_BATCH_WALLETS:
+        return {"error": f"At most {MAX_BATCH_WALLETS} wallets per request."}
+
+    # All sections of all wallets run at once, so their token lookups land in the same deduplicated
+    # price / icon batches and their contract reads in the same Multicall round trips
+    jobs = [(wallet, name, fn) for wallet in wallets for name, fn in WALLET_SECTIONS.items()]
+    results = await asyncio.gather(*(fn(wallet, log_mode, block_identifier) for wallet, name, fn in jobs))
+
+    per_wallet = {wallet: {} for wallet in wallets}
+    for (wallet, name, _), res in zip(jobs, results):
+        per_wallet[wallet][name] = res
+
+    totals = {name: 0.0 for name in WALLET_SECTIONS}
+    token_totals = {}
+    pending = []
+    for wallet, sections in per_wallet.items():
+        wallet_total = 0.0
+        for name, res in sections.items():
+            value = res.get("total_value_usd", 0) or 0
+            totals[name] += value
+            wallet_total += value
+            pending += [{**p, "wallet": wallet} for p in res.get("pending", [])]
+        sections["total_value_usd"] = round(wallet_total, 2)
+
+        # Same token held in several wallets is merged in the aggregate
+        for t in sections["portfolio"].get("tokens", []):
+            h = token_totals.setdefault(t["contract"], {
+                "name": t["name"],
+                "symbol": t["symbol"],
+                "contract": t["contract"],
+                "amount": 0.0,
+                "price_usd": t["price_usd"],
+                "total_usd": 0.0,
+                "icon_url": t["icon_url"],
+            })
+            h["amount"] += t["amount"]
+            h["total_usd"] += t["total_usd"]
+
+    return {
+        "wallets": per_wallet,
+        "aggregate": {
+            "totals_usd": {name: round(value, 2) for name, value in totals.items()},
+            "tokens": sorted(token_totals.values(), key=lambda x: x["total_usd"], reverse=True),
+            "total_value_usd": round(sum(totals.values()), 2),
+        },
+        "pending": pending,
+        "partial": bool(pending),
+    }